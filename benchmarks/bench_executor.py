@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: bench_executor.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-06 11:20
+#         Desc: Throughput of the handlers under mixed slow and fast
+#               queries, inline on the IOLoop and on the db_executor pool.
+#      History:
+# ----------------------------------------------------------
+
+Usage:
+    python benchmarks/bench_executor.py --requests 400 --concurrency 40 --slow-ratio 0.1 --slow-seconds 0.5
+
+A `bench_rows` table is served by an ApiManager route on a local port.
+Slow requests hold the database for --slow-seconds (pg_sleep / SLEEP) before
+the regular list GET, fast requests are the list GET alone. The same request
+mix is sent with db_executor off and on, and the requests/sec and the
+latency of the fast requests are reported for both.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tornado.web
+import tornado.ioloop
+from tornado import gen
+from tornado.options import options
+from tornado.httpclient import AsyncHTTPClient
+from tornado.netutil import bind_sockets
+from tornado.httpserver import HTTPServer
+
+from scarecrow import ApiManager, Base, engine
+from scarecrow.handler import BaseHandler
+from scarecrow.executor import executor
+from sqlalchemy import Table, Column, Integer, String
+
+TABLE_NAME = 'bench_rows'
+
+bench_rows = Table(TABLE_NAME, Base.metadata,
+                   Column('id', Integer, primary_key=True),
+                   Column('order_number', String(128), nullable=False),
+                   Column('status', Integer, default=0))
+
+SLEEP = {'postgresql': "SELECT pg_sleep(%f)", 'mysql': "SELECT SLEEP(%f)"}
+
+
+class SlowHandler(BaseHandler):
+    """
+        The list GET, after a server-side sleep when X-Bench-Slow is set.
+    """
+
+    def get_many(self, fields=None):
+        seconds = self.request.headers.get('X-Bench-Slow')
+        if seconds is not None:
+            self.instance.session.execute(SLEEP[engine.dialect.name] % float(seconds))
+        return BaseHandler.get_many(self, fields)
+
+
+def seed(rows=1000):
+    bench_rows.drop(engine, checkfirst=True)
+    bench_rows.create(engine)
+    engine.execute(bench_rows.insert(), [{"order_number": "ORDER-%08d" % i, "status": i % 3} for i in range(rows)])
+
+
+@gen.coroutine
+def run(port, plan, concurrency):
+    client    = AsyncHTTPClient(max_clients=concurrency)
+    url       = "http://127.0.0.1:%d/api/%s?results_per_page=20" % (port, TABLE_NAME)
+    latencies = []
+    queue     = list(plan)
+
+    @gen.coroutine
+    def worker():
+        while queue:
+            slow    = queue.pop()
+            headers = {'X-Bench-Slow': str(slow)} if slow else {}
+            start   = time.time()
+            yield client.fetch(url, headers=headers, request_timeout=600)
+            if not slow:
+                latencies.append(time.time() - start)
+
+    start = time.time()
+    yield [worker() for _ in range(concurrency)]
+    raise gen.Return((time.time() - start, sorted(latencies)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0])
+    parser.add_argument('--requests', type=int, default=400, help='requests per mode')
+    parser.add_argument('--concurrency', type=int, default=40, help='requests in flight')
+    parser.add_argument('--slow-ratio', type=float, default=0.1, help='share of slow requests')
+    parser.add_argument('--slow-seconds', type=float, default=0.5, help='database time of a slow request')
+    parser.add_argument('--workers', type=int, default=options.db_executor_workers, help='db_executor_workers')
+    args = parser.parse_args()
+
+    if engine.dialect.name not in SLEEP:
+        parser.error("no server-side sleep for the %s dialect" % engine.dialect.name)
+
+    random.seed(0)
+    plan = [args.slow_seconds if random.random() < args.slow_ratio else 0 for _ in range(args.requests)]
+    options.db_executor_workers = args.workers
+
+    seed()
+    app = tornado.web.Application([])
+    ApiManager(application=app).create_api(TABLE_NAME, handler_class=SlowHandler, results_per_page=20)
+    sockets = bind_sockets(0, '127.0.0.1')
+    HTTPServer(app).add_sockets(sockets)
+    port = sockets[0].getsockname()[1]
+
+    print("%10s %12s %12s %14s %14s" % ("mode", "seconds", "req/sec", "fast p50 (ms)", "fast p99 (ms)"))
+    try:
+        for mode in (False, True):
+            options.db_executor = mode
+            elapsed, latencies = tornado.ioloop.IOLoop.current().run_sync(
+                lambda: run(port, plan, args.concurrency))
+            p50 = latencies[len(latencies) // 2] if latencies else 0
+            p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+            print("%10s %12.3f %12.1f %14.1f %14.1f" % ("executor" if mode else "inline", elapsed,
+                                                        len(plan) / elapsed, p50 * 1000, p99 * 1000))
+    finally:
+        executor.shutdown()
+        bench_rows.drop(engine, checkfirst=True)
+
+if __name__ == '__main__':
+    main()
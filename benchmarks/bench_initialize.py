@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: bench_initialize.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-14 10:30
+#         Desc: Per-request cost of BaseHandler.initialize, binding to the
+#               RouteContext against the initialize it replaced.
+#      History:
+# ----------------------------------------------------------
+
+Usage:
+    python benchmarks/bench_initialize.py --requests 20000
+
+A `bench_rows` table is routed with ApiManager and its handler is built
+--requests times for a bare GET request, without sending it, in three modes:
+
+    old:     the initialize of BaseHandler before the RouteContext, copied
+             below, given the settings one by one
+    kwargs:  the same settings given to the current initialize, which
+             builds a RouteContext from them for every request
+    shared:  every handler bound to the RouteContext of the route
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tornado.web
+from tornado.httputil import HTTPServerRequest
+from tornado.options import options
+
+from scarecrow import ApiManager, AlchemyWrapper, Base, engine
+from scarecrow.route import RouteContext
+from scarecrow.serializer import serializer_for
+from scarecrow.unitofwork import UnitOfWork
+from sqlalchemy import Table, Column, Integer, String
+
+TABLE_NAME = 'bench_rows'
+
+bench_rows = Table(TABLE_NAME, Base.metadata,
+                   Column('id', Integer, primary_key=True),
+                   Column('order_number', String(128), nullable=False))
+
+
+class Connection(object):
+    """
+        Just enough of an HTTP connection for a RequestHandler that never answers.
+    """
+
+    def set_close_callback(self, callback):
+        pass
+
+
+def old_handler(handler_class):
+    """
+        handler_class with the initialize it had before the RouteContext.
+    """
+
+    class OldHandler(handler_class):
+
+        def initialize(self, table_name, methods, manager, preprocessor, postprocessor,
+                       allow_patch_many, allow_method_override, validation_exceptions,
+                       exclude_queries, exclude_hybrids, include_columns, exclude_columns,
+                       results_per_page, max_results_per_page, count_mode, max_ids_per_request,
+                       regex, application_name):
+            if allow_method_override and 'X-HTTP-Method-Override' in self.request.headers:
+                self.request.method = self.request.headers['X-HTTP-Method-Override']
+
+            tornado.web.RequestHandler.initialize(self)
+            self.serializer = serializer_for(self.application)
+            self.table_name = table_name
+            self.unit = UnitOfWork()
+            self.instance = AlchemyWrapper(table_name, unit=self.unit)
+
+            self.application_name = application_name
+            self.regex = regex
+            if not self.regex.endswith('$'):
+                self.regex += '$'
+
+            self.attribute = getattr(options, "attribute", "scarecrow")
+            self.node_code = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(self.regex + self.attribute)))
+            self.login_address = self.request.headers.get('X-Real-Ip', self.request.remote_ip)
+
+            self.methods = [method.lower() for method in methods]
+            self.allow_patch_many = allow_patch_many
+            self.validation_exceptions = validation_exceptions
+
+            self.preprocessor = preprocessor
+            self.postprocessor = postprocessor
+
+            self.include_columns = include_columns
+            self.exclude_columns = exclude_columns
+
+            self.results_per_page = results_per_page
+            self.max_results_per_page = max_results_per_page
+            self.count_mode = count_mode
+            self.max_ids_per_request = max_ids_per_request
+
+            self.multi = {}
+            self.token = None
+            self.control = getattr(options, "access_control", False)
+
+    return OldHandler
+
+
+def old_settings(route):
+    """
+        The arguments create_api_blueprint gave initialize before the RouteContext.
+    """
+    return dict((field, getattr(route, field)) for field in RouteContext.FIELDS
+                if field not in ('hooks', 'cache_queries', 'attribute', 'node_code'))
+
+
+def run(app, handler_class, requests, kwargs):
+    start = time.time()
+    for _ in range(requests):
+        request = HTTPServerRequest(method='GET', uri='/api/%s' % TABLE_NAME, connection=Connection())
+        handler = handler_class(app, request, **kwargs)
+        handler.unit.close()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0])
+    parser.add_argument('--requests', type=int, default=20000, help='handlers built per mode')
+    args = parser.parse_args()
+
+    bench_rows.create(engine, checkfirst=True)
+    app  = tornado.web.Application([])
+    spec = ApiManager(application=app).create_api_blueprint(TABLE_NAME, methods=ApiManager.METHODS_ALL)
+
+    route = spec.kwargs['route']
+    modes = (("old", old_handler(spec.handler_class), old_settings(route)),
+             ("kwargs", spec.handler_class, old_settings(route)),
+             ("shared", spec.handler_class, {'route': route}))
+
+    print("%12s %12s %16s" % ("mode", "seconds", "us/request"))
+    try:
+        for label, handler_class, kwargs in modes:
+            run(app, handler_class, 100, kwargs)
+        for label, handler_class, kwargs in modes:
+            elapsed = run(app, handler_class, args.requests, kwargs)
+            print("%12s %12.3f %16.2f" % (label, elapsed, elapsed / args.requests * 1e6))
+    finally:
+        bench_rows.drop(engine, checkfirst=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: bench_read_path.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-03-28 14:20
+#         Desc: Compares the ORM read path (entities + to_dict) with the
+#               Core read path of AlchemyWrapper.all().
+#      History:
+# ----------------------------------------------------------
+
+Usage:
+    python benchmarks/bench_read_path.py --rows 10000,100000,1000000
+
+A `bench_rows` table shaped like `order` is created in the scarecrow
+database, filled, read with both paths and dropped (unless --keep). Every
+measurement runs in a forked process, so the peak RSS growth it reports is
+not polluted by the previous run.
+
+The table lives in the database of the configured connector, the numbers
+depend on it and on its driver and are only comparable between the two
+paths of the same run.
+"""
+
+import os
+import sys
+import time
+import random
+import resource
+import argparse
+import datetime
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scarecrow
+from scarecrow import AlchemyWrapper, Base, engine
+from sqlalchemy import Table, Column, Integer, String, DateTime
+
+TABLE_NAME = 'bench_rows'
+
+bench_rows = Table(TABLE_NAME, Base.metadata,
+                   Column('id', Integer, primary_key=True),
+                   Column('order_number', String(128), nullable=False),
+                   Column('customer_name', String(128)),
+                   Column('product_amount', Integer, nullable=False),
+                   Column('status', Integer, default=0),
+                   Column('note', String(2048)),
+                   Column('created_timestamp', DateTime, default=datetime.datetime.now))
+
+
+def seed(rows, chunk=5000):
+    bench_rows.drop(engine, checkfirst=True)
+    bench_rows.create(engine)
+    note = 'x' * 256
+    for start in range(0, rows, chunk):
+        engine.execute(bench_rows.insert(), [{"order_number": "ORDER-%08d" % i,
+                                              "customer_name": "customer-%d" % (i % 97),
+                                              "product_amount": random.randint(1, 10000),
+                                              "status": i % 3,
+                                              "note": note}
+                                             for i in range(start, min(start + chunk, rows))])
+
+
+def orm_path(wrapper):
+    # the read path of AlchemyWrapper.all() before the Core fetch
+    return [wrapper.to_dict(row.__dict__) for row in wrapper.session.query(wrapper.model).all()]
+
+
+def core_path(wrapper):
+    return wrapper.all()
+
+
+def _measure(name, queue):
+    wrapper = AlchemyWrapper(TABLE_NAME)
+    func    = {"orm": orm_path, "core": core_path}[name]
+    before  = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start   = time.time()
+    rows    = len(func(wrapper))
+    elapsed = time.time() - start
+    peak    = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    queue.put((rows, elapsed, peak))
+
+
+def measure(name):
+    queue   = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(name, queue))
+    process.start()
+    result  = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage:')[0])
+    parser.add_argument('--rows', default='10000,100000,1000000', help='comma separated table sizes')
+    parser.add_argument('--keep', action='store_true', help='keep the bench_rows table')
+    args = parser.parse_args()
+
+    engine.dispose()
+    print("%10s %6s %12s %14s %14s" % ("rows", "path", "seconds", "rows/sec", "peak RSS (KB)"))
+    try:
+        for rows in [int(size) for size in args.rows.split(',')]:
+            seed(rows)
+            engine.dispose()
+            for name in ("orm", "core"):
+                fetched, elapsed, peak = measure(name)
+                print("%10d %6s %12.3f %14.0f %14d" % (fetched, name, elapsed, fetched / elapsed, peak))
+    finally:
+        if not args.keep:
+            bench_rows.drop(engine, checkfirst=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: bench_serializer.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-01 10:05
+#         Desc: Micro-benchmark of the response serializers.
+#      History:
+# ----------------------------------------------------------
+
+Usage:
+    python benchmarks/bench_serializer.py --rows 100 --repeat 200
+
+Encodes a GET envelope of rows shaped like the `order`, `customer`, `users`
+and `operation_logs` models with the legacy encoder (indent + sort_keys +
+JSONEncoder subclass) and every installed backend of scarecrow.serializer,
+pretty and compact. serializer.py is loaded on its own so no database is
+needed.
+"""
+
+import os
+import imp
+import json
+import timeit
+import argparse
+import datetime
+
+serializer = imp.load_source('serializer', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                        'scarecrow', 'serializer.py'))
+
+
+def rows(count):
+    now    = datetime.datetime(2016, 3, 31, 18, 20, 5)
+    result = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:    # order
+            row = {"id": i, "order_number": "SO2016%06d" % i, "order_type": 1, "customer_name": u"客户%d" % (i % 50),
+                   "product_amount": 2000, "spare_amount": 20, "note": u"备注" * 200, "status": 0,
+                   "left_point": i * 2000, "right_point": i * 2000 + 1999,
+                   "storage_file_name": "sn_%06d.csv" % i, "relative_file_location": "/data/orders/2016/03/",
+                   "created_timestamp": "2016-03-31 18:20:05", "updated_timestamp": "2016-03-31 18:20:05"}
+        elif kind == 1:  # customer
+            row = {"id": i, "customer_name": u"客户%d" % i, "status": 1, "area": u"深圳", "note": None,
+                   "customer_ID": "%02d" % (i % 100), "model_ID": "01", "left_point": 0, "right_point": 99999999,
+                   "offset_point": 0, "test_offset_point": 90000000,
+                   "created_timestamp": "2016-03-31 18:20:05", "updated_timestamp": "2016-03-31 18:20:05"}
+        elif kind == 2:  # users
+            row = {"id": i, "username": "user%d" % i, "password": "e10adc3949ba59abbe56e057f20f883e",
+                   "nickname": u"用户%d" % i, "code": "397d7c28-06d4-382d-8854-4af3f143d945", "status": 1,
+                   "note": None, "email": "user%d@sowell-tech.com" % i,
+                   "role_code": "1ff04c83-2308-3f26-81ff-dedfd3031b85", "created_timestamp": now,
+                   "login_address": "192.168.1.10", "last_address": "192.168.1.10", "recent_access_time": now}
+        else:            # operation_logs
+            row = {"id": i, "username": "admin", "role_name": "root", "operation": "put",
+                   "user_code": "397d7c28-06d4-382d-8854-4af3f143d945",
+                   "role_code": "1ff04c83-2308-3f26-81ff-dedfd3031b85", "opt_address": "192.168.1.10",
+                   "request_arguments": json.dumps({"name": "hello"}), "request_body": json.dumps({"name": "haha"}),
+                   "request_path": "/api/resource/1,2", "created_timestamp": now}
+        result.append(row)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100, help='rows in the envelope')
+    parser.add_argument('--repeat', type=int, default=200, help='encodings per measurement')
+    args = parser.parse_args()
+
+    envelope = {"num_results": 10000, "total_pages": 100, "count_mode": "exact", "page": 1,
+                "objects": rows(args.rows)}
+
+    candidates = [("legacy", lambda obj: json.dumps(obj, sort_keys=True, indent=2, ensure_ascii=False,
+                                                    cls=serializer.DateTimeEncoder))]
+    for backend in serializer.BACKENDS:
+        try:
+            __import__(backend)
+        except ImportError:
+            continue
+        for compact in (False, True):
+            instance = serializer.Serializer(backend, compact)
+            candidates.append(("%s/%s" % (instance.backend, "compact" if compact else "pretty"), instance.dumps))
+
+    baseline = None
+    print("%-20s %12s %12s %10s" % ("serializer", "ms/response", "bytes", "speedup"))
+    for name, dumps in candidates:
+        seconds = min(timeit.repeat(lambda: dumps(envelope), number=args.repeat, repeat=3)) / args.repeat
+        size    = len(dumps(envelope).encode('utf-8'))
+        baseline = baseline or seconds
+        print("%-20s %12.3f %12d %9.1fx" % (name, seconds * 1000, size, baseline / seconds))
+
+if __name__ == '__main__':
+    main()
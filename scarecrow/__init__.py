@@ -7,10 +7,17 @@
 import logging
 import importlib
 from tornado.log import LogFormatter as _LogFormatter
-from .globals import secret_key, running_dir, Base, Session, engine, attribute
+from .globals import secret_key, running_dir, Base, Session, engine, attribute, pool_stats
 
 from .api import  ApiManager
 from .wrapper import BaseWrapper, AlchemyWrapper
+from .unitofwork import UnitOfWork
+from .route import RouteContext
+from .schema import registry, inspector, fkgraph
+from .executor import executor_stats
+from .hooks import hook_stats
+from .versions import versions
+from .querycache import query_cache_stats
 from tornado_rbac import RBAC, AccessControl, recordOpt
 
 
@@ -34,11 +41,17 @@ logger.addHandler(channel)
 from sqlalchemy.orm.session import Session
 from sqlalchemy.event import listen
 from sqlalchemy import orm
+from .querycache import querycache, WRITTEN_TABLES
 
 def AlchemyJSON(obj_dict):
     return dict((key, obj_dict[key]) for key in obj_dict if not key.startswith("_"))
 
 class _SessionSignalEvents(object):
+    """
+        Collects the tables written by a session, ORM flushes and bulk
+        Query.update()/delete() alike, and drops their cached query results
+        once the session commits. A rollback forgets them.
+    """
 
     def __init__(self):
         self.session = Session
@@ -46,19 +59,29 @@ class _SessionSignalEvents(object):
     def register(self):
         listen(self.session, 'after_bulk_update', self.receive_after_bulk_update)
         listen(self.session, 'after_bulk_delete', self.receive_after_bulk_delete)
+        listen(self.session, 'after_commit', self.receive_after_commit)
+        listen(self.session, 'after_rollback', self.receive_after_rollback)
 
-    def receive_after_bulk_update(self, session, query, query_context, result):
-        "listen for the ’after_bulk_update’ event"
-        affected_table = query_context.statement.froms[0].name
-        affected_rows  = query_context.statement.execute()
-        print "receive_after_bulk_update", affected_rows, affected_table
+    def receive_after_bulk_update(self, update_context):
+        "listen for the 'after_bulk_update' event"
+        self.record(update_context.session, update_context.mapper.local_table.name)
 
-    def receive_after_bulk_delete(self, session, query, query_context, result):
-        "listen for the ’after_bulk_delete’ event"
-        affected_table = query_context.statement.froms[0].name
-        affected_rows  = query_context.statement.execute()
-        print "receive_after_bulk_delete", affected_rows, affected_table
-        # thread.start_new_thread(preprocessor, ('delete', affected_table, affected_rows))
+    def receive_after_bulk_delete(self, delete_context):
+        "listen for the 'after_bulk_delete' event"
+        self.record(delete_context.session, delete_context.mapper.local_table.name)
+
+    def receive_after_commit(self, session):
+        tables = session.info.pop(WRITTEN_TABLES, None)
+        if tables:
+            querycache.invalidate(*tables)
+
+    def receive_after_rollback(self, session):
+        session.info.pop(WRITTEN_TABLES, None)
+
+    @staticmethod
+    def record(session, table):
+        if session is not None:
+            session.info.setdefault(WRITTEN_TABLES, set()).add(table)
 
 class _MapperSignalEvents(object):
 
@@ -81,11 +104,12 @@ class _MapperSignalEvents(object):
 
     @staticmethod
     def _record(mapper, target, operation):
-        print("_MapperSignalEvents:op=%s, table_name=%s, json=%s" % (operation, mapper.local_table.name, AlchemyJSON(target.__dict__)))
+        # the results are dropped when the session of target commits
+        _SessionSignalEvents.record(orm.object_session(target), mapper.local_table.name)
 
 # this must happen only once
-# _SessionSignalEvents().register()
-# _MapperSignalEvents(orm.mapper).register()
+_SessionSignalEvents().register()
+_MapperSignalEvents(orm.mapper).register()
 
 # Dynamic loading the models module.
 importlib.import_module('models')# imp.load_module('models', *imp.find_module('models'))
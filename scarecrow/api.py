@@ -15,7 +15,11 @@
 from tornado.web import URLSpec
 
 from .handler import BaseHandler
+from .route import RouteContext
+from .hooks import HookPipeline
 from .errors import IllegalArgumentError
+from .schema import fkgraph
+from .wrapper import COUNT_MODES
 
 class ApiManager(object):
     """
@@ -37,6 +41,8 @@ class ApiManager(object):
         :param application: is the tornado.web.Application object
         """
         self.application = application
+        # index the foreign keys once, multi-table routing then skips the catalog.
+        fkgraph.build()
 
     def create_api_blueprint(self,
                              table_name,
@@ -54,6 +60,9 @@ class ApiManager(object):
                              exclude_columns=None,
                              results_per_page=10,
                              max_results_per_page=100,
+                             count_mode='exact',
+                             max_ids_per_request=100,
+                             cache_queries=False,
                              blueprint_prefix='',
                              handler_class=BaseHandler):
         """
@@ -72,9 +81,14 @@ class ApiManager(object):
         :param exclude_columns: Blacklist of columns to be excluded
         :param results_per_page: The default value of how many results are returned per request
         :param max_results_per_page: The hard upper limit of resutest per page
+        :param count_mode: How num_results of a paginated GET is produced unless the request
+                           sets ?count=: exact, cached, estimate or none
+        :param max_ids_per_request: The hard upper limit of primary keys in one /resource/1,2,... request
+        :param cache_queries: Serve the GETs from the query result cache, dropped on every write to the tables read
         :param blueprint_prefix: The Prefix that will be used to unique collection_name for named_handlers
-        :param preprocessor: A dictionary of list of preprocessors that get called
-        :param postprocessor: A dictionary of list of postprocessor that get called
+        :param preprocessor: A dictionary of list of preprocessors that get called, by phase
+                             (see :mod:`scarecrow.hooks`)
+        :param postprocessor: A dictionary of list of postprocessor that get called, by phase
         :param handler_class: The Handler Class that will be used in the route
         :type handler_class: tornado_restless.handler.BaseHandler or a subclass
         :return: :class:`tornado.web.URLSpec`
@@ -83,29 +97,37 @@ class ApiManager(object):
         if exclude_columns is not None and include_columns is not None:
             raise IllegalArgumentError('Cannot simultaneously specify both include columns and exclude columns.')
 
+        if count_mode not in COUNT_MODES:
+            raise IllegalArgumentError('count_mode must be one of %s.' % ', '.join(COUNT_MODES))
+
         regex = "%s/%s(?:/(.+))?[/]?" % (url_prefix, table_name)
         application_name = '%s%s' % (blueprint_prefix, table_name)
-        kwargs = {'table_name': table_name,
-                  'manager': self,
-                  'methods': methods,
-                  'preprocessor': preprocessor or {},
-                  'postprocessor': postprocessor or {},
-                  'allow_patch_many': allow_patch_many,
-                  'allow_method_override': allow_method_override,
-                  'validation_exceptions': validation_exceptions,
-                  'include_columns': include_columns,
-                  'exclude_columns': exclude_columns,
-                  'exclude_queries': exclude_queries,
-                  'exclude_hybrids': exclude_hybrids,
-                  'results_per_page': results_per_page,
-                  'max_results_per_page': max_results_per_page,
-                  'regex': regex,
-                  'application_name': application_name}
+        # worked out once here, the handlers of every request only bind to it
+        route = RouteContext(table_name=table_name,
+                             manager=self,
+                             methods=methods,
+                             preprocessor=preprocessor or {},
+                             postprocessor=postprocessor or {},
+                             hooks=HookPipeline(preprocessor, postprocessor, application_name),
+                             allow_patch_many=allow_patch_many,
+                             allow_method_override=allow_method_override,
+                             validation_exceptions=validation_exceptions,
+                             include_columns=include_columns,
+                             exclude_columns=exclude_columns,
+                             exclude_queries=exclude_queries,
+                             exclude_hybrids=exclude_hybrids,
+                             results_per_page=results_per_page,
+                             max_results_per_page=max_results_per_page,
+                             count_mode=count_mode,
+                             max_ids_per_request=max_ids_per_request,
+                             cache_queries=cache_queries,
+                             regex=regex,
+                             application_name=application_name)
 
         blueprint = URLSpec(
             regex,
             handler_class,
-            kwargs,
+            {'route': route},
             application_name)
         return blueprint
 
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: cache.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-03-22 15:40
+#         Desc: Small in-process caches shared by the scarecrow modules.
+#      History:
+# ----------------------------------------------------------
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+        A thread-safe mapping that keeps at most `capacity` entries and evicts
+        the least recently used one first.
+
+        When `ttl` is given, entries older than `ttl` seconds are treated as
+        missing.
+    """
+
+    def __init__(self, capacity=1024, ttl=None):
+        self.capacity  = capacity
+        self.ttl       = ttl
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._lock     = threading.RLock()
+        self._data     = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                return default
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl     = self.ttl if ttl is None else ttl
+        expires = None if not ttl else time.time() + ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: executor.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-06 11:20
+#         Desc: Runs the database work of the handlers off the IOLoop.
+#      History:
+# ----------------------------------------------------------
+
+With --db_executor the handlers yield their wrapper calls to a thread pool
+of db_executor_workers threads, so a slow query only holds one worker and
+the IOLoop keeps serving the other requests. At most db_executor_pending
+calls are queued or running, the next ones wait on the IOLoop.
+
+Without it the calls run inline, as they always did.
+"""
+
+import time
+import logging
+import threading
+from tornado import gen
+from tornado.locks import Semaphore
+from tornado.options import define, options
+
+from .globals import Session
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # python 2 without the futures backport
+    ThreadPoolExecutor = None
+
+define("db_executor", default=False, help="run the database work of the handlers on a thread pool.", type=bool)
+define("db_executor_workers", default=10, help="threads of the database thread pool.", type=int)
+define("db_executor_pending", default=100, help="database calls queued or running at most.", type=int)
+
+
+class DatabaseExecutor(object):
+    """
+        A bounded thread pool for blocking database calls.
+
+        Each AlchemyWrapper owns its session and a request waits for one call
+        before it submits the next, so a session is never used by two threads
+        at once. The thread-local session of the scoped Session is removed
+        after every call, so a worker never leaks one to the next request.
+    """
+
+    def __init__(self):
+        self._lock      = threading.Lock()
+        self._pool      = None
+        self._semaphore = None
+        self.submitted  = 0
+        self.completed  = 0
+        self.failed     = 0
+        self.waiting    = 0
+        self.running    = 0
+        self.busy_time  = 0.0
+
+    @property
+    def enabled(self):
+        return options.db_executor
+
+    def _start(self):
+        with self._lock:
+            if self._pool is not None:
+                return
+            if ThreadPoolExecutor is None:
+                raise RuntimeError("db_executor needs concurrent.futures, pip install futures")
+            connections = options.db_pool_size + options.db_max_overflow
+            if options.db_pool_class == 'queue' and options.db_executor_workers > connections:
+                logging.warning("db_executor_workers[%d] > db_pool_size + db_max_overflow[%d], "
+                                "workers will wait for connections." % (options.db_executor_workers, connections))
+            self._semaphore = Semaphore(options.db_executor_pending)
+            self._pool      = ThreadPoolExecutor(options.db_executor_workers)
+
+    @gen.coroutine
+    def submit(self, func, *args, **kwargs):
+        """
+            Run func(*args, **kwargs) on the pool, inline when db_executor is off.
+
+            :return: a Future resolving to the result of func
+        """
+        if not self.enabled:
+            raise gen.Return(func(*args, **kwargs))
+
+        self._start()
+        self.waiting += 1
+        try:
+            yield self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            self.submitted += 1
+            result = yield self._pool.submit(self._run, func, args, kwargs)
+        finally:
+            self._semaphore.release()
+        raise gen.Return(result)
+
+    def _run(self, func, args, kwargs):
+        start = time.time()
+        with self._lock:
+            self.running += 1
+        try:
+            result = func(*args, **kwargs)
+        except:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            Session.remove()
+            with self._lock:
+                self.running   -= 1
+                self.completed += 1
+                self.busy_time += time.time() - start
+        return result
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait)
+
+    def stats(self):
+        return {"enabled": self.enabled,
+                "workers": options.db_executor_workers,
+                "pending_limit": options.db_executor_pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "waiting": self.waiting,
+                "running": self.running,
+                "busy_time": self.busy_time}
+
+
+executor = DatabaseExecutor()
+
+
+def executor_stats():
+    """
+        Statistics of the database thread pool, for monitoring.
+    """
+    return executor.stats()
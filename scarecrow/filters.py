@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: filters.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-03-22 15:40
+#         Desc: Compiles the JSON filters/or_/not_ arguments into SQLAlchemy
+#               expressions.
+#      History:
+# ----------------------------------------------------------
+"""
+
+import json
+import logging
+
+from .cache import LRUCache
+from .errors import IllegalArgumentError
+
+
+def _has(left, right):
+    if isinstance(right, list):
+        return left.any(*right)
+    return left.has(right)
+
+# Operators from flask-restless, plus the additional ones of scarecrow.
+OPERATORS = {
+    "is_null":     lambda left, right: left.is_(None),
+    "is_not_null": lambda left, right: left.isnot(None),
+    "is":          lambda left, right: left.is_(right),
+    "is_not":      lambda left, right: left.isnot(right),
+    "ilike":       lambda left, right: left.ilike(right),
+    "not_ilike":   lambda left, right: left.notilike(right),
+    "like":        lambda left, right: left.like('%' + right + '%'),
+    "not_like":    lambda left, right: left.notlike(right),
+    "match":       lambda left, right: left.match(right),
+    "in":          lambda left, right: left.in_(right),
+    "not_in":      lambda left, right: left.notin_(right),
+    "has":         _has,
+    "any":         lambda left, right: left.any(right),
+    "between":     lambda left, right: left.between(*right),
+    "contains":    lambda left, right: left.contains(right),
+    "startswith":  lambda left, right: left.startswith(right),
+    "endswith":    lambda left, right: left.endswith(right),
+    "attr_is":     lambda left, right: getattr(left, right),
+    "method_is":   lambda left, right: getattr(left, right)(),
+}
+
+for _names, _operator in ((("==", "eq", "equals", "equals_to"),             lambda left, right: left == right),
+                          (("!=", "ne", "neq", "not_equal_to", "does_not_equal"), lambda left, right: left != right),
+                          ((">", "gt"),                                     lambda left, right: left > right),
+                          (("<", "lt"),                                     lambda left, right: left < right),
+                          ((">=", "ge", "gte", "geq"),                      lambda left, right: left >= right),
+                          (("<=", "le", "lte", "leq"),                      lambda left, right: left <= right)):
+    for _name in _names:
+        OPERATORS[_name] = _operator
+
+
+class FilterPlan(object):
+    """
+        The compiled form of a filter list: the resolved column and operator
+        of every predicate, ready to be bound to the request values.
+    """
+
+    __slots__ = ('steps',)
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def bind(self, argument_filters):
+        return [operator(left, _value(argument_filter))
+                for (left, operator), argument_filter in zip(self.steps, argument_filters)]
+
+
+class FilterCompiler(object):
+    """
+        Turns filter arguments into FilterPlans.
+
+        Plans are cached by the shape of the filters (model, names and ops),
+        so a request only has to parse the JSON and bind its values.
+    """
+
+    def __init__(self, capacity=512):
+        self.plans = LRUCache(capacity)
+
+    def to_filters(self, model, argument_filters):
+        """
+            Return the SQLAlchemy expressions of argument_filters.
+
+            :param model: the mapped class the filters apply to
+            :param argument_filters: list of filter dicts or its JSON encoding
+            :raise: IllegalArgumentError
+        """
+        argument_filters = self.parse(argument_filters)
+        return self.compile(model, argument_filters).bind(argument_filters)
+
+    @staticmethod
+    def parse(argument_filters):
+        if not isinstance(argument_filters, list):
+            try:
+                argument_filters = json.loads(argument_filters)
+            except (TypeError, ValueError):
+                raise IllegalArgumentError("filters[%s] is not a JSON list" % argument_filters)
+            if not isinstance(argument_filters, list):
+                argument_filters = [argument_filters]
+
+        for argument_filter in argument_filters:
+            if not isinstance(argument_filter, dict):
+                raise IllegalArgumentError("filter[%s] is not an object" % argument_filter)
+            if "name" not in argument_filter:
+                raise IllegalArgumentError("Missing fieldname attribute 'name'")
+        return argument_filters
+
+    def compile(self, model, argument_filters):
+        shape = (model, tuple((argument_filter["name"], argument_filter.get("op"))
+                              for argument_filter in argument_filters))
+        plan  = self.plans.get(shape)
+        if plan is None:
+            logging.info("FilterCompiler| compile %s" % (shape[1],))
+            plan = FilterPlan(tuple(self._compile_step(model, name, op) for name, op in shape[1]))
+            self.plans.set(shape, plan)
+        return plan
+
+    @staticmethod
+    def _compile_step(model, name, op):
+        if name == "~":
+            return model, OPERATORS["attr_is"]
+
+        left = getattr(model, name, None)
+        if left is None:
+            raise IllegalArgumentError("Unknown field[%s]" % name)
+
+        operator = OPERATORS.get(op)
+        if operator is None:
+            # Test comparator
+            if op is None or not hasattr(left.comparator, op):
+                raise IllegalArgumentError("Unknown operator[%s]" % op)
+            operator = lambda left, right: getattr(left.comparator, op)(right)
+        return left, operator
+
+
+def _value(argument_filter):
+    if "val" in argument_filter:
+        return argument_filter["val"]
+    # Because we hate abbr sometimes ...
+    return argument_filter.get("value")
+
+compiler = FilterCompiler()
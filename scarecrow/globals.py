@@ -14,14 +14,65 @@
 """
 
 import sys,os
+import time
 import logging
+import threading
 import tornado.web
 from tornado.options import define, options
-from sqlalchemy.pool import NullPool
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool, SingletonThreadPool
+from sqlalchemy import create_engine, MetaData, event, exc
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 define("db", default='create', help="setting the data base operation.", type=str)
+define("db_pool_class", default='queue', help="connection pool: queue, null, static or singleton.", type=str)
+define("db_pool_size", default=10, help="connections kept open by the queue pool.", type=int)
+define("db_max_overflow", default=20, help="connections opened beyond db_pool_size under load.", type=int)
+define("db_pool_timeout", default=30, help="seconds to wait for a free connection.", type=int)
+define("db_pool_pre_ping", default=False, help="test connections with SELECT 1 when checked out.", type=bool)
+define("db_pool_recycle", default=3600, help="seconds after which a connection is reopened, -1 never.", type=int)
+
+class _PoolStats(object):
+    """
+        Counters of the connection pool, read with pool_stats().
+    """
+
+    def __init__(self):
+        self.lock        = threading.Lock()
+        self.connects    = 0
+        self.checkouts   = 0
+        self.timeouts    = 0
+        self.disconnects = 0
+        self.wait_total  = 0.0
+        self.wait_max    = 0.0
+
+    def waited(self, seconds):
+        with self.lock:
+            self.checkouts  += 1
+            self.wait_total += seconds
+            self.wait_max    = max(self.wait_max, seconds)
+
+_stats = _PoolStats()
+
+class TimedQueuePool(QueuePool):
+    """
+        QueuePool measuring how long checkouts wait for a connection.
+    """
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return QueuePool._do_get(self)
+        except exc.TimeoutError:
+            with _stats.lock:
+                _stats.timeouts += 1
+            raise
+        finally:
+            _stats.waited(time.time() - start)
+
+POOL_CLASSES = {'queue': TimedQueuePool,
+                'null': NullPool,
+                'static': StaticPool,
+                'singleton': SingletonThreadPool}
 
 def parse_command_line(args=None, options_dict=None):
     if args is None:
@@ -38,7 +89,76 @@ def parse_command_line(args=None, options_dict=None):
         name, equals, value = arg.partition("=")
 
         if options_dict.has_key(name) and options_dict.get(name)!=value:
-            setattr(options, name, value)
+            # parse with the type of the definition, setattr would keep the string
+            option = options._options[options._normalize_name(name)]
+            if not equals and option.type == bool:
+                value = "true"
+            option.parse(value)
+
+def _pool_arguments():
+    """
+    The create_engine arguments of the configured pool.
+    """
+    if options.db_pool_class not in POOL_CLASSES:
+        raise ValueError("db_pool_class must be one of %s" % ", ".join(sorted(POOL_CLASSES)))
+
+    arguments = {'poolclass': POOL_CLASSES[options.db_pool_class],
+                 'pool_recycle': options.db_pool_recycle}
+    if options.db_pool_class == 'queue':
+        arguments.update(pool_size=options.db_pool_size,
+                         max_overflow=options.db_max_overflow,
+                         pool_timeout=options.db_pool_timeout)
+    elif options.db_pool_class == 'singleton':
+        arguments.update(pool_size=options.db_pool_size)
+    return arguments
+
+def _listen_pool(engine):
+    """
+    Count the new connections and ping the checked out ones if db_pool_pre_ping.
+    """
+
+    @event.listens_for(engine, 'connect')
+    def receive_connect(dbapi_connection, connection_record):
+        with _stats.lock:
+            _stats.connects += 1
+
+    if not options.db_pool_pre_ping:
+        return
+
+    @event.listens_for(engine, 'checkout')
+    def receive_checkout(dbapi_connection, connection_record, connection_proxy):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except:
+            with _stats.lock:
+                _stats.disconnects += 1
+            # the pool drops this connection and retries with a new one
+            raise exc.DisconnectionError()
+        finally:
+            cursor.close()
+
+def pool_stats():
+    """
+    Statistics of the connection pool, for monitoring.
+
+    :return: dict
+    """
+    pool   = engine.pool
+    result = {"pool_class": options.db_pool_class,
+              "connects": _stats.connects,
+              "checkouts": _stats.checkouts,
+              "timeouts": _stats.timeouts,
+              "disconnects": _stats.disconnects,
+              "wait_total": _stats.wait_total,
+              "wait_max": _stats.wait_max,
+              "wait_avg": _stats.wait_total / _stats.checkouts if _stats.checkouts else 0.0}
+    if isinstance(pool, QueuePool):
+        result.update(size=pool.size(),
+                      checked_in=pool.checkedin(),
+                      checked_out=pool.checkedout(),
+                      overflow=pool.overflow())
+    return result
 
 def _get_alchemy_object(connector):
     """
@@ -71,7 +191,8 @@ def _get_alchemy_object(connector):
         exit()
 
     # Init SQLAlchemy engine.
-    engine  = create_engine(connector, echo=False, poolclass=NullPool, pool_recycle=3600)
+    engine  = create_engine(connector, echo=False, **_pool_arguments())
+    _listen_pool(engine)
     metadata= MetaData(engine)
     Base    = declarative_base(metadata=metadata)
     Session = scoped_session(sessionmaker(bind=engine))
@@ -12,32 +12,31 @@
 # ----------------------------------------------------------
 """
 
-import inspect
-import uuid
 import logging
 
 import scarecrow
-from json import loads, JSONEncoder, dumps
+from json import loads
 from math import ceil
 from traceback import print_exception
-from datetime import date, datetime
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm.exc import UnmappedInstanceError
 from sqlalchemy.util import memoized_instancemethod
+from tornado import gen
 from tornado.web import RequestHandler, HTTPError
-from tornado.options import options
+from tornado.options import define, options
 
 from .errors import IllegalArgumentError, MethodNotAllowedError, ProcessingException
-from .wrapper import AlchemyWrapper, BaseWrapper
-
-class DateTimeEncoder(JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.strftime('%Y-%m-%d %H:%M:%S')
-        elif isinstance(obj, date):
-            return obj.strftime('%Y-%m-%d')
-        else:
-            return JSONEncoder.default(self, obj)
+from .wrapper import AlchemyWrapper, BaseWrapper, COUNT_MODES
+from .schema import fkgraph
+from .pagination import encode_cursor, decode_cursor
+from .serializer import DateTimeEncoder, serializer_for
+from .executor import executor
+from .unitofwork import UnitOfWork
+from .route import RouteContext
+from .hooks import DONE, HookPipeline, log_failure
+from .versions import versions
+
+define("stream_chunk_size", default=500, help="rows fetched and flushed at a time by ?stream=true GETs.", type=int)
 
 class BaseHandler(RequestHandler):
     """
@@ -53,79 +52,112 @@ class BaseHandler(RequestHandler):
     SPRIT = "/"
     ID_SEPARATOR = ","
     SUPPORTED_METHODS = ['GET', 'POST', 'PUT', 'DELETE']
+    # query arguments that steer the request instead of filtering it
+    CONTROL_ARGUMENTS = frozenset(['offset', 'page', 'limit', 'results_per_page', 'single',
+                                   'after', 'count', 'fields', 'stream'])
 
     # noinspection PyMethodOverriding
-    def initialize(self,
-                   table_name,
-                   methods,
-                   manager,
-                   preprocessor,
-                   postprocessor,
-                   allow_patch_many,
-                   allow_method_override,
-                   validation_exceptions,
-                   exclude_queries,
-                   exclude_hybrids,
-                   include_columns,
-                   exclude_columns,
-                   results_per_page,
-                   max_results_per_page,
-                   regex,
-                   application_name):
-        """
-
-        Init of the handler, derives arguments from api create_api_blueprint
-
-        :param table_name:
-        :param methods: Allowed methods for this model
-        :param manager: The Scarecrow Api Manager
-        :param preprocessor: A dictionary of preprocessor functions
-        :param postprocessor: A dictionary of postprocessor functions
-        :param allow_patch_many: Allow PATCH with multiple datasets
-        :param allow_method_override: Support X-HTTP-Method-Override Header
-        :param validation_exceptions:
-        :param exclude_queries: Don't execude dynamic queries (like from associations or lazy relations)
-        :param exclude_hybrids: When exclude_queries is True and exclude_hybrids is False, hybrids are still included.
-        :param include_columns: Whitelist of columns to be included
-        :param exclude_columns: Blacklist of columns to be excluded
-        :param results_per_page: The default value of how many results are returned per request
-        :param max_results_per_page: The hard upper limit of resutest per page
+    def initialize(self, route=None, **kwargs):
+        """
+
+        Init of the handler, binds it to the settings of its route
+
+        :param route: The :class:`scarecrow.route.RouteContext` built by create_api_blueprint
+        :param kwargs: Without route, the settings initialize used to take one by one (table_name,
+                       methods, regex, ...), a RouteContext is then built from them for every request
         :reqheader X-HTTP-Method-Override: If allow_method_override is True, this header overwrites the request method
         """
 
+        if route is None:
+            kwargs.setdefault('hooks', HookPipeline(kwargs.get('preprocessor'), kwargs.get('postprocessor')))
+            route = RouteContext(**kwargs)
+
         # Override Method if Header provided
-        if allow_method_override and 'X-HTTP-Method-Override' in self.request.headers:
+        if route.allow_method_override and 'X-HTTP-Method-Override' in self.request.headers:
             self.request.method = self.request.headers['X-HTTP-Method-Override']
 
         super(BaseHandler, self).initialize()
-        self.table_name = table_name
-        self.instance = AlchemyWrapper(table_name)
-
-        self.application_name = application_name
-        self.regex = regex
-        if not self.regex.endswith('$'):
-            self.regex += '$'
-
-        self.attribute = getattr(options, "attribute", "scarecrow")
-        self.node_code = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(self.regex + self.attribute)))
+        self.route = route
+        self.serializer = serializer_for(self.application)
+        self.table_name = route.table_name
+        # all the wrappers of the request share this session, closed in on_finish
+        self.unit = UnitOfWork()
+        self.instance = AlchemyWrapper(route.table_name, unit=self.unit, cache=route.cache_queries, model=route.model)
+
+        self.application_name = route.application_name
+        self.regex = route.regex
+        self.attribute = route.attribute
+        self.node_code = route.node_code
         self.login_address = self.request.headers.get('X-Real-Ip', self.request.remote_ip)
 
-        self.methods = [method.lower() for method in methods]
-        self.allow_patch_many = allow_patch_many
-        self.validation_exceptions = validation_exceptions
+        self.methods = route.methods
+        self.allow_patch_many = route.allow_patch_many
+        self.validation_exceptions = route.validation_exceptions
+
+        self.preprocessor = route.preprocessor
+        self.postprocessor = route.postprocessor
+        self.hooks = route.hooks
 
-        self.preprocessor = preprocessor
-        self.postprocessor = postprocessor
+        self.include_columns = route.include_columns
+        self.exclude_columns = route.exclude_columns
 
-        self.results_per_page = results_per_page
-        self.max_results_per_page = max_results_per_page
+        self.results_per_page = route.results_per_page
+        self.max_results_per_page = route.max_results_per_page
+        self.count_mode = route.count_mode
+        self.max_ids_per_request = route.max_ids_per_request
 
         self.multi = {}
         self.token = None
         self.control = getattr(options, "access_control", False)
 
     def parse_pk(self, instance_id):
-        return instance_id.split(self.ID_SEPARATOR)
+        """
+            :statuscode 400: more than max_ids_per_request primary keys
+        """
+        ids = instance_id.split(self.ID_SEPARATOR)
+        if len(ids) > self.max_ids_per_request:
+            raise IllegalArgumentError("request has %d ids > application.max_ids_per_request" % len(ids))
+        return ids
+
+    def parse_fields(self, instance_id):
+        """
+            Return the column list of /resource/name,id, None if instance_id
+            is not made of column names
+        """
+        columns = set(column['name'] for column in BaseWrapper().getColumns(self.table_name))
+        fields  = [field for field in instance_id.split(self.ID_SEPARATOR) if len(field)>0]
+        if len(fields)>0 and columns.issuperset(fields):
+            return fields
+        return None
+
+    def get_fields(self, requested=None):
+        """
+            The columns a GET loads: ?fields= (or the given list), restricted by
+            the include_columns/exclude_columns of the route
+
+            :return: list of column names, None to load every column
+            :statuscode 400: a requested column is unknown or not exposed
+        """
+        if requested is None:
+            requested = self.get_query_argument("fields", None)
+            if requested is not None:
+                requested = [field for field in requested.split(self.ID_SEPARATOR) if len(field)>0]
+
+        columns = [column['name'] for column in BaseWrapper().getColumns(self.table_name)]
+        if self.include_columns is not None:
+            allowed = [column for column in columns if column in self.include_columns]
+        elif self.exclude_columns is not None:
+            allowed = [column for column in columns if column not in self.exclude_columns]
+        else:
+            allowed = columns
+
+        if not requested:
+            return None if len(allowed)==len(columns) else allowed
+
+        for field in requested:
+            if field not in allowed:
+                raise IllegalArgumentError("request.fields[%s] is not a column of %s" % (field, self.table_name))
+        return requested
 
     def parse_fk(self, fk_args):
         result = {}
@@ -142,11 +174,11 @@ class BaseHandler(RequestHandler):
         """
         arguments = {}
         for arg in self.request.arguments:
-            if arg not in ('offset', 'page', 'limit', 'results_per_page'):
+            if arg not in self.CONTROL_ARGUMENTS:
                 arguments[arg] = self.get_argument(arg)
 
         if self.control:
-            tkn = scarecrow.AccessControl()
+            tkn = scarecrow.AccessControl(self.unit)
 
             stuff_info = tkn.stuffParams(self.request.method, self.token,
                                          self.login_address, res_code=self.node_code,
@@ -166,12 +198,8 @@ class BaseHandler(RequestHandler):
             :statuscode 200: instance successfull removed
         """
 
-        # Trigger deletion
-        number = 0
-        self.pkey = BaseWrapper().getPrimaryKeys(self.table_name).get('constrained_columns', [])[0]
-        for pk in instance_id:
-            trigger = {self.pkey:pk}
-            number += self.instance.delete(**trigger)
+        # Trigger deletion, all or nothing
+        number = self.instance.delete_by_ids(instance_id)
         # Status
         self.set_status(200, "Instance removed")
         return {"num_removed": number}
@@ -189,14 +217,12 @@ class BaseHandler(RequestHandler):
         # All search params
         search_params = self.get_search_params()
 
-        # Call Preprocessor
-        # self._call_preprocessor(filters=filters)
-
         num = self.instance.delete(**search_params)
         # Result
         self.set_status(200, "Removed")
         return {'num_removed': num}
 
+    @gen.coroutine
     def delete(self, instance_id=None):
         """
             DELETE request
@@ -213,33 +239,46 @@ class BaseHandler(RequestHandler):
             raise MethodNotAllowedError(self.request.method)
 
         # Call Preprocessor
-        # self._call_preprocessor(search_params=self.search_params)
+        yield self._call_preprocessor("delete", instance_id=instance_id)
 
         if instance_id is None:
             if self.allow_patch_many:
-                result = self.delete_many()
+                result = yield executor.submit(self.delete_many)
             else:
                 raise MethodNotAllowedError(self.request.method, status_code=403)
         else:
-            result = self.delete_single(self.parse_pk(instance_id))
+            result = yield executor.submit(self.delete_single, self.parse_pk(instance_id))
 
-        # self._call_postprocessor(result=result)
-        self.finish(result)
+        yield self._call_postprocessor("delete", result=result)
+        self.write_json(result)
 
     def get_single(self, instance_id):
         """
-            Get one instance
+            Get instances by primary key
+
+            All the rows are read by one query, objects follow the order of
+            instance_id and the ids without a row are listed in missing.
 
             :param instance_id: query argument of request
             :type instance_id: list of primary keys
         """
         if self.instance is None:
             raise IllegalArgumentError("instance is None")
-        result = self.instance.get(*instance_id)
+        result, missing = self.instance.get_by_ids(instance_id, fields=self.get_fields())
         return {"num_results": len(result),
                 "total_pages": 1,
                 "page": 1,
-                "objects": result}
+                "objects": result,
+                "missing": missing}
+
+    def get_count_mode(self):
+        """
+            The count mode of the request, ?count= overrides the route's default
+        """
+        count_mode = self.get_query_argument("count", self.count_mode)
+        if count_mode not in COUNT_MODES:
+            raise IllegalArgumentError("request.count must be one of %s" % ", ".join(COUNT_MODES))
+        return count_mode
 
     def get_multi_table(self):
         """
@@ -255,22 +294,37 @@ class BaseHandler(RequestHandler):
         params = self.multi.get("params")
         # Get table's primary keys
         self.pkey = BaseWrapper().getPrimaryKeys(keyword).get('constrained_columns', [])[0]
-        # Offset & Page
-        page = int(self.get_argument("page", '1'))
-        search_params["offset"] = (page-1) * results_per_page
+        # Offset & Page, or the cursor of a keyset page
+        after = self.get_query_argument("after", None)
+        if after is None:
+            page = int(self.get_argument("page", '1'))
+            search_params["offset"] = (page-1) * results_per_page
+        else:
+            page = None
+            search_params["after"] = decode_cursor(after) if len(after) else None
         # Limit
         search_params['limit'] = self.get_query_argument("limit", results_per_page)
         # Order_by & Direction
         search_params["order_by"] = self.get_argument('order_by', self.pkey)
         search_params["direction"] = self.get_argument('direction', 'desc')
+        search_params["count_mode"] = self.get_count_mode()
 
         result = self.instance.multiple_table_query(keyword, dict(params, **search_params))
-        return {"num_results": result.get('count', 0),
-                "total_pages": int(ceil((result.get('count', 0) + results_per_page - 1) / results_per_page)),
-                "page": page,
-                "objects": result.get(keyword,[])}
-
-    def get_many(self):
+        num_results = result.get('count', 0)
+        if num_results is None:
+            total_pages = None
+        else:
+            total_pages = int(ceil((num_results + results_per_page - 1) / results_per_page))
+        response = {"num_results": num_results,
+                    "total_pages": total_pages,
+                    "count_mode": result.get('count_mode', search_params["count_mode"]),
+                    "page": page,
+                    "objects": result.get(keyword,[])}
+        if after is not None:
+            response["next_cursor"] = result.get("next_cursor")
+        return response
+
+    def get_many(self, fields=None):
         """
             Get all instances
 
@@ -282,8 +336,74 @@ class BaseHandler(RequestHandler):
             :query results_per_page: Overwrite the returned results_per_page
             :query offset: Skip offset instances
             :query page: Return nth page
+            :query count: How num_results is produced: exact, cached (exact, served from a
+                          TTL cache keyed by the filters), estimate (planner estimate) or none
+            :query after: Keyset pagination, return the page after this cursor
+                          (empty for the first page) and its next_cursor
             :query limit: limit the count of modified instances
             :query single: If true sqlalchemy will raise an error if zero or more than one instances would be deleted
+            :query fields: Comma separated columns to load, in place of the whole rows
+
+            :param fields: The columns requested by /resource/name,id
+        """
+        search_params, result, keyset = self.get_many_params(fields)
+
+        if self.get_query_argument("single", False) and keyset is None:
+            objects = self.instance.one(**search_params)
+        else:
+            objects = self.instance.all(**search_params)
+
+        if keyset is not None:
+            result["next_cursor"] = self.next_cursor(objects, search_params, *keyset)
+        result["objects"] = objects
+        return result
+
+    @gen.coroutine
+    def stream_many(self, fields=None):
+        """
+            Get all instances as a chunked response
+
+            Same envelope as get_many, but the rows are read from a server-side
+            cursor and every chunk of objects is written and flushed as soon as
+            it is fetched, so memory stays bounded whatever the page size.
+        """
+        search_params, result, keyset = yield executor.submit(self.get_many_params, fields)
+
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        comma = ',' if self.serializer.compact else ', '
+        head = self.serializer.dumps(result).rstrip()
+        self.write(head[:-1] + comma + '"objects": [')
+
+        separator = ''
+        streamed = 0
+        chunks = self.instance.iter_chunks(options.stream_chunk_size, **search_params)
+        while True:
+            objects = yield executor.submit(next, chunks, None)
+            if objects is None:
+                break
+            streamed += len(objects)
+            if keyset is not None:
+                cursor_row = dict(objects[-1])
+                self.strip_keyset(objects, keyset[1])
+            chunk = comma.join(self.serializer.dumps(row) for row in objects)
+            self.write(separator + chunk)
+            separator = comma
+            yield self.flush()
+
+        tail = ']'
+        if keyset is not None:
+            next_cursor = None
+            if streamed > 0 and streamed >= int(search_params['limit']):
+                next_cursor = encode_cursor([cursor_row.get(key) for key in keyset[0]])
+            tail += '%s"next_cursor": %s' % (comma, self.serializer.dumps(next_cursor))
+        self.finish(tail + '}')
+
+    def get_many_params(self, fields=None):
+        """
+            Count the instances and build the search params of a list GET
+
+            :return: (search_params, the response envelope without objects,
+                      None or the (keys, extra) of a keyset page)
         """
         if self.instance is None:
             raise IllegalArgumentError("instance is None")
@@ -298,30 +418,95 @@ class BaseHandler(RequestHandler):
             raise IllegalArgumentError("request.results_per_page > application.max_results_per_page")
 
         # Num Results
-        num_results = self.instance.count(**search_params)
-        if results_per_page:
+        num_results, count_mode = self.instance.total(self.get_count_mode(), **search_params)
+        if num_results is None:
+            total_pages = None
+        elif results_per_page:
             total_pages = ceil((num_results + results_per_page - 1) / results_per_page)
         else:
             total_pages = 1
+        result = {"num_results": num_results,
+                  "total_pages": total_pages,
+                  "count_mode": count_mode}
+
+        # Limit
+        search_params['limit'] = self.get_query_argument("limit", results_per_page)
+        # Columns
+        fields = self.get_fields(fields)
+        if fields is not None:
+            search_params['fields'] = fields
+
+        after = self.get_query_argument("after", None)
+        if after is not None:
+            result["page"] = None
+            return search_params, result, self.get_keyset_params(search_params, after)
 
         # Offset & Page
         page = int(self.get_argument("page", '1'))
         search_params['offset'] = int(self.get_query_argument("offset", 0)) + (page - 1) * results_per_page
         if search_params['offset'] < 0:
             raise IllegalArgumentError("request.offset < 0")
-        # Limit
-        search_params['limit'] = self.get_query_argument("limit", results_per_page)
+        result["page"] = page
+        return search_params, result, None
 
-        if self.get_query_argument("single", False):
-            result = self.instance.one(**search_params)
-        else:
-            result = self.instance.all(**search_params)
+    def get_keyset_params(self, search_params, after):
+        """
+            Set up the search params of the page after a cursor
+
+            Rows are sorted on order_by plus the primary key as a tiebreak, so
+            the page is found with an index seek instead of OFFSET.
+
+            :param after: the next_cursor of the previous page, empty for the first page
+            :return: (the sort key columns, the ones loaded only to build the cursor)
+        """
+        search_params["order_by"] = self.get_argument('order_by', self.pkey)
+        search_params["direction"] = self.get_argument('direction', 'asc')
+        search_params["after"] = decode_cursor(after) if len(after) else None
+        keys = self.instance.keyset_columns(search_params["order_by"])
+        # the sort key has to be loaded to build the cursor
+        fields = search_params.get('fields')
+        extra = [key for key in keys if key not in fields] if fields else []
+        if len(extra) > 0:
+            search_params['fields'] = fields + extra
+        return keys, extra
+
+    def next_cursor(self, objects, search_params, keys, extra):
+        """
+            The cursor of the page following objects, None on the last page
+        """
+        next_cursor = None
+        if len(objects) > 0 and len(objects) >= int(search_params['limit']):
+            next_cursor = encode_cursor([objects[-1].get(key) for key in keys])
+        self.strip_keyset(objects, extra)
+        return next_cursor
+
+    @staticmethod
+    def strip_keyset(objects, extra):
+        for row in objects:
+            for key in extra:
+                row.pop(key, None)
+
+    def get_etag(self):
+        """
+            The version ETag of this GET: the tables it reads, the path and the
+            query, and who asks when access control is on. None with --etag off.
+        """
+        if not options.etag:
+            return None
+        tables = [self.table_name] + self.multi.get("tables", [])
+        parts  = [self.request.path, repr(sorted(self.request.arguments.items()))]
+        if self.control:
+            # the restrict rows of the user filter the result
+            tables.append("restrict")
+            data = scarecrow.AccessControl(self.unit).isTokenValid(self.token) or {}
+            parts.extend([data.get("user_code"), data.get("role_code")])
+            self.set_header("Vary", "token")
+        return versions.etag(tables, *parts)
 
-        return {"num_results": num_results,
-                "total_pages": total_pages,
-                "page": page,
-                "objects": result}
+    def is_streaming(self):
+        return self.get_query_argument("stream", "false").lower() in ("1", "true")
 
+    @gen.coroutine
     def get(self, instance_id=None):
         """
             GET request
@@ -329,6 +514,10 @@ class BaseHandler(RequestHandler):
             :param instance_id: query argument of request
             :type instance_id: comma seperated string list
 
+            :query stream: If true, list GETs are written as a chunked response
+            :reqheader If-None-Match: the ETag of a previous response to the same GET
+
+            :statuscode 304: the tables were not written since the ETag of If-None-Match
             :statuscode 405: GET disallowed
         """
         logging.info('BaseHandler|get, table_name:%s, instance_id:%s, request.arguments=%s.'
@@ -337,22 +526,43 @@ class BaseHandler(RequestHandler):
         if not 'get' in self.methods:
             raise MethodNotAllowedError(self.request.method)
 
-        # Call Preprocessor
-        self._call_preprocessor(instance_id=instance_id, request_arguments=self.request.arguments)
-        # Get table's primary keys
-        self.pkey = BaseWrapper().getPrimaryKeys(self.table_name).get('constrained_columns', [])[0]
+        self.resolve_multi_table(instance_id)
+        # Get table's primary keys, those of the route unless a multi-table path changed the table
+        if len(self.multi) == 0:
+            self.pkey = self.route.primary_key
+        else:
+            self.pkey = BaseWrapper().getPrimaryKeys(self.table_name).get('constrained_columns', [])[0]
 
-        if instance_id is None:
-            result = self.get_many()
+        fields = None
+        if instance_id is not None and len(self.multi) == 0:
+            fields = self.parse_fields(instance_id)
+
+        # Call Preprocessor
+        phase = "get_many" if instance_id is None or fields is not None else "get_single"
+        yield self._call_preprocessor(phase, instance_id=instance_id, request_arguments=self.request.arguments)
+
+        # the versions are read before the query, a write meanwhile changes the next ETag
+        etag = self.get_etag()
+        if etag is not None:
+            self.set_header("Etag", etag)
+            if self.check_etag_header():
+                self.set_status(304)
+                self.finish()
+                return
+
+        if phase == "get_many":
+            if self.is_streaming():
+                yield self.stream_many(fields)
+                yield self._call_postprocessor(phase, result=None)
+                return
+            result = yield executor.submit(self.get_many, fields)
+        elif len(self.multi):
+            result = yield executor.submit(self.get_multi_table)
         else:
-            if len(self.multi):
-                result = self.get_multi_table()
-            else:
-                result = self.get_single(self.parse_pk(instance_id))
+            result = yield executor.submit(self.get_single, self.parse_pk(instance_id))
 
-        # self._call_postprocessor(result=result)
-        result = dumps(result, sort_keys=True, indent=2, ensure_ascii=False, cls=DateTimeEncoder)
-        self.finish(result)
+        yield self._call_postprocessor(phase, result=result)
+        self.write_json(result)
 
     def get_argument_values(self):
         """
@@ -376,17 +586,13 @@ class BaseHandler(RequestHandler):
 
     def put_single(self, instance_id):
         values = self.get_argument_values()
-        # Trigger
-        number = 0
-        self.pkey = BaseWrapper().getPrimaryKeys(self.table_name).get('constrained_columns', [])[0]
-        for pk in instance_id:
-            trigger = {self.pkey:pk}
-            ret = self.instance.update(values, **trigger)
-            number = (number+1) if ret else number
+        # Trigger, all or nothing
+        number = self.instance.update_by_ids(values, instance_id)
         # Result
         self.set_status(200, "updated")
         return {'num_updated': number}
 
+    @gen.coroutine
     def put(self, instance_id=None):
         """
             PUT (update instance) request
@@ -403,27 +609,45 @@ class BaseHandler(RequestHandler):
             raise MethodNotAllowedError(self.request.method)
 
         # Call Preprocessor
-        # self._call_preprocessor(search_params=self.search_params)
+        yield self._call_preprocessor("put", instance_id=instance_id)
 
         if instance_id is None:
             if self.allow_patch_many:
-                result = self.put_many()
+                result = yield executor.submit(self.put_many)
             else:
                 raise MethodNotAllowedError(self.request.method, status_code=403)
         else:
-            result = self.put_single(self.parse_pk(instance_id))
+            result = yield executor.submit(self.put_single, self.parse_pk(instance_id))
 
-        # self._call_postprocessor(result=result)
-        result = dumps(result, sort_keys=True, indent=2, ensure_ascii=False, cls=DateTimeEncoder)
-        self.finish(result)
+        yield self._call_postprocessor("put", result=result)
+        self.write_json(result)
 
     def post_single(self):
         """
-            Post one instance
+            Post one instance, or an array of instances
         """
         values = self.get_argument_values()
+        if isinstance(values, list):
+            return self.post_many(values)
         return self.instance.insert(values)
 
+    def post_many(self, values):
+        """
+            Post an array of instances in batches
+
+            :return: the result of every instance and errorcode 1 only if all were inserted
+        """
+        if not all(isinstance(value, dict) for value in values):
+            raise IllegalArgumentError("request.body must be an object or an array of objects")
+
+        objects = self.instance.insert_many(values)
+        failed  = len([obj for obj in objects if obj.get("errorcode") != 1])
+        return {"errorcode": 0 if failed else 1,
+                "num_inserted": len(objects) - failed,
+                "num_failed": failed,
+                "objects": objects}
+
+    @gen.coroutine
     def post(self, instance_id=None):
         """
             POST (new input) request
@@ -439,36 +663,70 @@ class BaseHandler(RequestHandler):
             raise MethodNotAllowedError(self.request.method)
 
         # Call Preprocessor
-        # self._call_preprocessor(search_params=self.search_params)
+        yield self._call_preprocessor("post")
 
-        result = self.post_single()
+        result = yield executor.submit(self.post_single)
 
-        # self._call_postprocessor(result=result)
-        result = dumps(result, sort_keys=True, indent=2, ensure_ascii=False, cls=DateTimeEncoder)
-        self.finish(result)
+        yield self._call_postprocessor("post", result=result)
+        self.write_json(result)
 
+    @gen.coroutine
     def prepare(self):
         """
             Prepare the request
         """
         self.token = self.request.headers.get('token', None)
         if self.control:
-            tkn = scarecrow.AccessControl()
-            is_allowed = tkn.isAccessAllowed(self.token, self.request.method, self.login_address, res_code=self.node_code)
-            if is_allowed==False:
-                raise MethodNotAllowedError(self.request.method)
-            else:
-                request_body = self.get_body_arguments() if self.request.method.lower() in ("post", "put") else None
-                scarecrow.recordOpt(self.token, self.request.method, self.request.path,
-                                    self.get_search_params(), request_body)
-        self._call_preprocessor()
+            yield executor.submit(self.check_access)
+        yield self._call_preprocessor("prepare")
+        yield self._call_postprocessor("prepare")
+
+    def check_access(self):
+        """
+            Check the token of the request against RBAC and record the operation
+
+            :statuscode 405: access denied
+        """
+        tkn = scarecrow.AccessControl(self.unit)
+        is_allowed = tkn.isAccessAllowed(self.token, self.request.method, self.login_address, res_code=self.node_code)
+        if is_allowed==False:
+            raise MethodNotAllowedError(self.request.method)
+        else:
+            request_body = self.get_body_arguments() if self.request.method.lower() in ("post", "put") else None
+            scarecrow.recordOpt(self.token, self.request.method, self.request.path,
+                                self.get_search_params(), request_body, unit=self.unit)
 
     def on_finish(self):
         """
             Finish the request
         """
 
-        self._call_postprocessor()
+        try:
+            pending = self._call_preprocessor("finish")
+            if pending is DONE:
+                pending = self._call_postprocessor("finish")
+            else:
+                pending = self._finish_postprocessors(pending)
+            if pending is not DONE:
+                # the response is sent, nobody waits for an asynchronous hook
+                log_failure(pending)
+        finally:
+            self.unit.close()
+
+    @gen.coroutine
+    def _finish_postprocessors(self, preprocessors):
+        """
+            The finish postprocessors, once the asynchronous finish preprocessors are done
+        """
+        yield preprocessors
+        yield self._call_postprocessor("finish")
+
+    def write_json(self, result):
+        """
+            Finish the request with result encoded by the application's serializer
+        """
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.finish(self.serializer.dumps(result))
 
     def write_error(self, status_code, **kwargs):
         """
@@ -556,56 +814,55 @@ class BaseHandler(RequestHandler):
         else:
             return default
 
-    def _call_preprocessor(self, **kwargs):
-        """
-            Calls a preprocessor with args and kwargs
-        """
-
-        # Multi table judge
-        if kwargs.has_key("instance_id") \
-                and kwargs.has_key("request_arguments")\
-                and self.request.method.lower()=='get':
-            instance_id = kwargs.get("instance_id")
-            if instance_id is not None:
-                if self.ID_SEPARATOR in instance_id and self.SPRIT in instance_id:
-                    raise MethodNotAllowedError(self.request.method)
-                elif self.SPRIT in instance_id:
-                    self.instance = None
-                    instance_id = instance_id[:-1] if instance_id.endswith(self.SPRIT) else instance_id
-                    baseURI= self.table_name + '/' + instance_id
-                    tables = baseURI.split('/')[::2]
-                    target = baseURI.split('/')[1::2]
-                    keyword= tables[-1]
-                    base   = BaseWrapper()
-                    logging.info('Multi table|get keyword=%s, table list is:%s , code list is:%s.' % (keyword, tables, target))
-
-                    if(len(tables)-len(target)!=1):
-                        raise MethodNotAllowedError(self.request.method, status_code=400)
-
-                    for table in base.showTables():
-                        fkeys = self.parse_fk(base.getForeignKeys(table))
-                        if set(tables)==set(fkeys.keys()) \
-                                or (self.get_query_argument("distinct", False)
-                                    and len(fkeys.keys())>0
-                                    and len(set(tables)-set(fkeys.keys()))==0):
-                            fields = [fkeys[key] for key in tables]
-                            self.table_name = table
-                            self.multi = {"keyword": keyword, "params": dict(zip(fields, target))}
-                            self.instance = AlchemyWrapper(self.table_name)
-                            break
-                else:
-                    pass
+    def resolve_multi_table(self, instance_id):
+        """
+            Route a GET of table/code/table/... to the table joining them all
+
+            :statuscode 400: the path does not alternate tables and codes
+            :statuscode 405: primary keys list in a multi-table path
+        """
+        if instance_id is None:
+            return
+        if self.ID_SEPARATOR in instance_id and self.SPRIT in instance_id:
+            raise MethodNotAllowedError(self.request.method)
+        elif self.SPRIT in instance_id:
+            self.instance = None
+            instance_id = instance_id[:-1] if instance_id.endswith(self.SPRIT) else instance_id
+            baseURI= self.table_name + '/' + instance_id
+            tables = baseURI.split('/')[::2]
+            target = baseURI.split('/')[1::2]
+            keyword= tables[-1]
+            logging.info('Multi table|get keyword=%s, table list is:%s , code list is:%s.' % (keyword, tables, target))
+
+            if(len(tables)-len(target)!=1):
+                raise MethodNotAllowedError(self.request.method, status_code=400)
 
-        func_name = inspect.stack()[1][3]
-        if func_name in self.preprocessor:
-            for func in self.preprocessor[func_name]:
-                func(table_name=self.table_name, handler=self, **kwargs)
+            match = fkgraph.resolve(tables, superset=bool(self.get_query_argument("distinct", False)))
+            if match is not None:
+                table, fkeys = match
+                fields = [fkeys[key] for key in tables]
+                self.table_name = table
+                self.multi = {"keyword": keyword, "params": dict(zip(fields, target)), "tables": tables}
+                self.instance = AlchemyWrapper(self.table_name, unit=self.unit, cache=self.route.cache_queries)
 
-    def _call_postprocessor(self, *args, **kwargs):
+    def _call_preprocessor(self, phase, **kwargs):
         """
-            Calls a postprocessor with args and kwargs
+            Calls the preprocessors of phase with kwargs
+
+            :return: a Future to yield, resolved already unless a hook is asynchronous
+        """
+        hooks = self.hooks.pre[phase]
+        if not hooks:
+            return DONE
+        return self.hooks.run(hooks, phase, "preprocessor", self, **kwargs)
+
+    def _call_postprocessor(self, phase, *args, **kwargs):
+        """
+            Calls the postprocessors of phase with args and kwargs
+
+            :return: a Future to yield, resolved already unless a hook is asynchronous
         """
-        func_name = inspect.stack()[1][3]
-        if func_name in self.postprocessor:
-            for func in self.postprocessor[func_name]:
-                func(*args, table_name=self.table_name, handler=self, **kwargs)
\ No newline at end of file
+        hooks = self.hooks.post[phase]
+        if not hooks:
+            return DONE
+        return self.hooks.run(hooks, phase, "postprocessor", self, *args, **kwargs)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: hooks.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-15 09:50
+#         Desc: The preprocessors and postprocessors of a route, by phase.
+#      History:
+# ----------------------------------------------------------
+
+The preprocessor and postprocessor dictionaries of create_api_blueprint map
+a phase of the request to a list of hooks:
+
+    prepare:    after the access check of every request
+    get_many:   a list GET (also ?stream=true and /resource/1,2/fields)
+    get_single: a GET by primary keys, or of a multi-table path
+    post:       a POST of one object or an array
+    put:        a PUT by primary keys or, with allow_patch_many, by filters
+    delete:     a DELETE by primary keys or, with allow_patch_many, by filters
+    finish:     once the response is sent
+
+A preprocessor is called as hook(table_name=..., handler=..., **kwargs) before
+the database work of its phase, a postprocessor after it, with result=the
+response. prepare and finish have no database work of their own: the
+prepare postprocessors run right after the prepare preprocessors, both after
+the access check, and the finish preprocessors run before the finish
+postprocessors, both without result.
+
+A hook may return a Future (a gen.coroutine does), the request then waits
+for it. Nothing waits for the finish hooks, the response is sent already:
+the postprocessors follow the preprocessors once they are done, and an
+error is only logged. The older keys 'get' (both GET phases) and 'on_finish'
+(finish) are still understood.
+"""
+
+import time
+import logging
+from tornado import gen
+from tornado.concurrent import Future, is_future
+from tornado.ioloop import IOLoop
+
+PHASES = ('prepare', 'get_many', 'get_single', 'post', 'put', 'delete', 'finish')
+
+# the keys that used to be found by the name of the calling handler method
+LEGACY_PHASES = {'get': ('get_many', 'get_single'),
+                 'on_finish': ('finish',)}
+
+# what a phase without pending hooks yields, resolved already
+DONE = Future()
+DONE.set_result(None)
+
+_pipelines = []
+
+
+def _hook_name(hook):
+    return "%s.%s" % (getattr(hook, "__module__", None), getattr(hook, "__name__", repr(hook)))
+
+
+class HookPipeline(object):
+    """
+        The hooks of one route, resolved to a tuple per phase when the route is
+        created. A phase without hooks costs the handler a dict lookup, and
+        the time of every hook is added up in timing.
+    """
+
+    def __init__(self, preprocessor=None, postprocessor=None, name=None):
+        self.name   = name
+        self.pre    = self._resolve(preprocessor or {}, "preprocessor")
+        self.post   = self._resolve(postprocessor or {}, "postprocessor")
+        self.timing = {}
+        # the unnamed ones are built per request (a handler given the old settings), not reported
+        if name is not None:
+            _pipelines.append(self)
+
+    def _resolve(self, processors, kind):
+        hooks = dict((phase, []) for phase in PHASES)
+        for key, functions in processors.items():
+            phases = LEGACY_PHASES.get(key, (key,))
+            if phases[0] not in hooks:
+                logging.warning("%s[%s] of %s is not a phase (%s), it is never called."
+                                % (kind, key, self.name, ", ".join(PHASES)))
+                continue
+            for phase in phases:
+                hooks[phase].extend(functions)
+        return dict((phase, tuple(functions)) for phase, functions in hooks.items())
+
+    def run(self, hooks, phase, kind, handler, *args, **kwargs):
+        """
+            Call hooks one after another.
+
+            :return: DONE once they all ran, or a Future of the rest if one returned a Future
+        """
+        for index, hook in enumerate(hooks):
+            start  = time.time()
+            result = hook(*args, table_name=handler.table_name, handler=handler, **kwargs)
+            if is_future(result):
+                return self._resume(result, start, hooks[index:], phase, kind, handler, args, kwargs)
+            self._record(phase, kind, hook, time.time() - start)
+        return DONE
+
+    def _resume(self, future, start, hooks, phase, kind, handler, args, kwargs):
+        @gen.coroutine
+        def rest():
+            yield future
+            self._record(phase, kind, hooks[0], time.time() - start)
+            yield self.run(hooks[1:], phase, kind, handler, *args, **kwargs)
+        return rest()
+
+    def _record(self, phase, kind, hook, seconds):
+        key   = (phase, kind, _hook_name(hook))
+        entry = self.timing.get(key)
+        if entry is None:
+            entry = self.timing[key] = {"calls": 0, "seconds": 0.0, "max": 0.0}
+        entry["calls"]   += 1
+        entry["seconds"] += seconds
+        entry["max"]      = max(entry["max"], seconds)
+
+    def stats(self):
+        return dict(("%s %s %s" % key, dict(entry)) for key, entry in self.timing.items())
+
+
+def hook_stats():
+    """
+        Time spent in the hooks of every route, by phase, processor kind and hook.
+    """
+    return dict((pipeline.name, pipeline.stats()) for pipeline in _pipelines if pipeline.timing)
+
+
+def log_failure(future):
+    """
+        Log the error of a hook Future that nobody waits for (the finish phase).
+    """
+    IOLoop.current().add_future(future, lambda done: done.result())
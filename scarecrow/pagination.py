@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: pagination.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-03-24 09:30
+#         Desc: Keyset (seek) pagination helpers.
+#      History:
+# ----------------------------------------------------------
+"""
+
+import json
+import base64
+import binascii
+from decimal import Decimal
+from datetime import date, datetime
+from sqlalchemy.sql.expression import and_, or_
+
+from .errors import IllegalArgumentError
+
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+_DATE_FORMAT     = '%Y-%m-%d'
+
+
+def _encode(obj):
+    if isinstance(obj, datetime):
+        return {"$datetime": obj.strftime(_DATETIME_FORMAT)}
+    elif isinstance(obj, date):
+        return {"$date": obj.strftime(_DATE_FORMAT)}
+    elif isinstance(obj, Decimal):
+        return {"$decimal": str(obj)}
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+def _decode(obj):
+    if "$datetime" in obj:
+        return datetime.strptime(obj["$datetime"], _DATETIME_FORMAT)
+    elif "$date" in obj:
+        return datetime.strptime(obj["$date"], _DATE_FORMAT).date()
+    elif "$decimal" in obj:
+        return Decimal(obj["$decimal"])
+    return obj
+
+
+def encode_cursor(values):
+    """
+        Encode the sort key of the last row of a page into an opaque cursor.
+    """
+    payload = json.dumps(list(values), default=_encode, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+        Decode a cursor built by encode_cursor.
+
+        :raise: IllegalArgumentError if the cursor was not built by encode_cursor
+    """
+    try:
+        cursor  = str(cursor)
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values  = json.loads(payload.decode('utf-8'), object_hook=_decode)
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise IllegalArgumentError("request.after[%s] is not a valid cursor" % cursor)
+
+    if not isinstance(values, list):
+        raise IllegalArgumentError("request.after[%s] is not a valid cursor" % cursor)
+    return values
+
+
+def keyset_filter(columns, values, direction):
+    """
+        Build the predicate selecting the rows after `values` in the
+        (columns..., direction) order, i.e. for two columns a, b ascending:
+
+            a > :a OR (a = :a AND b > :b)
+
+        :raise: IllegalArgumentError if the cursor does not match the columns
+    """
+    if len(columns) != len(values):
+        raise IllegalArgumentError("request.after does not match the order_by of the request")
+
+    clauses = []
+    for index, column in enumerate(columns):
+        equals = [columns[i] == values[i] for i in range(index)]
+        if direction == 'asc':
+            equals.append(column > values[index])
+        else:
+            equals.append(column < values[index])
+        clauses.append(and_(*equals))
+    return or_(*clauses)
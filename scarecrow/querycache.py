@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: querycache.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-19 16:00
+#         Desc: Results of the read queries of the wrappers, dropped on write.
+#      History:
+# ----------------------------------------------------------
+
+The wrappers of a route created with cache_queries=True serve count, total,
+all, get/get_by_ids and multiple_table_query from here. An entry is keyed by
+the method, the table and the normalized arguments (filters, pagination,
+order), and depends on the tables it read: a committed write to any of them
+drops it, whether it was made through a wrapper (on_write) or through any
+session (the mapper and bulk events registered in scarecrow/__init__.py).
+
+Results are kept pickled, so a caller can't change a cached one and the
+memory budget query_cache_bytes counts real bytes. The least recently used
+entries are evicted first. Entries also expire after query_cache_ttl seconds,
+which bounds how long the writes of other processes go unnoticed.
+"""
+
+import json
+import time
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+from tornado.options import define, options
+
+define("query_cache_bytes", default=64 * 1024 * 1024, help="memory budget of the query result cache, in bytes.", type=int)
+define("query_cache_ttl", default=60, help="seconds a cached query result is served, 0 until a write.", type=int)
+
+# the key of the tables written by a session and not yet committed, in session.info
+WRITTEN_TABLES = 'scarecrow_written_tables'
+
+
+class QueryCache(object):
+
+    def __init__(self):
+        self._lock         = threading.RLock()
+        # key -> (expires, tables, pickled result)
+        self._entries      = OrderedDict()
+        # table -> keys of the entries that read it
+        self._tables       = {}
+        # table -> number of invalidations, a result computed across one is not stored
+        self._generation   = {}
+        self.size          = 0
+        self.hits          = 0
+        self.misses        = 0
+        self.evictions     = 0
+        self.invalidations = 0
+        self.too_large     = 0
+
+    @staticmethod
+    def key(*parts):
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    def fetch(self, key, tables, compute):
+        """
+            The cached result of key, or compute() stored for the next time.
+
+            :param tables: the tables compute() reads
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and (entry[0] is None or entry[0] > time.time()):
+                self._entries[key] = entry
+                self.hits += 1
+                return pickle.loads(entry[2])
+            if entry is not None:
+                self._forget(key, entry)
+            self.misses += 1
+            generations = [self._generation.get(table, 0) for table in tables]
+
+        result = compute()
+        data   = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if generations != [self._generation.get(table, 0) for table in tables]:
+                # written while it was computed
+                return result
+            if len(data) > options.query_cache_bytes // 16:
+                self.too_large += 1
+                return result
+            if key in self._entries:
+                self._forget(key, self._entries.pop(key))
+            expires = time.time() + options.query_cache_ttl if options.query_cache_ttl > 0 else None
+            self._entries[key] = (expires, tuple(tables), data)
+            self.size += len(data)
+            for table in tables:
+                self._tables.setdefault(table, set()).add(key)
+            while self.size > options.query_cache_bytes and self._entries:
+                self._forget(*self._entries.popitem(last=False))
+                self.evictions += 1
+        return result
+
+    def _forget(self, key, entry):
+        self.size -= len(entry[2])
+        for table in entry[1]:
+            keys = self._tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tables[table]
+
+    def invalidate(self, *tables):
+        """
+            Drop the results that read any of tables.
+        """
+        with self._lock:
+            for table in tables:
+                self._generation[table] = self._generation.get(table, 0) + 1
+                for key in list(self._tables.get(table, ())):
+                    self._forget(key, self._entries.pop(key))
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            for table in list(self._tables):
+                self.invalidate(table)
+
+    def stats(self):
+        return {"entries": len(self._entries),
+                "bytes": self.size,
+                "budget": options.query_cache_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "too_large": self.too_large}
+
+
+querycache = QueryCache()
+
+
+def query_cache_stats():
+    """
+        Statistics of the query result cache, for monitoring.
+    """
+    return querycache.stats()
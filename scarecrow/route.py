@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: route.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-14 10:30
+#         Desc: The settings of an api route, worked out once per route.
+#      History:
+# ----------------------------------------------------------
+"""
+
+import uuid
+from tornado.options import options
+
+from .schema import registry, inspector
+
+
+class RouteContext(object):
+    """
+        Everything a handler needs from create_api_blueprint that does not
+        depend on the request: the allowed methods, the anchored regex, the
+        resource code of the route, its HookPipeline and its limits.
+
+        It is built once by ApiManager.create_api_blueprint and shared by all
+        the requests of the route, so it cannot be changed. The model and the
+        primary key come from the schema caches, a route may be created
+        before its table.
+    """
+
+    FIELDS = ('table_name', 'manager', 'methods', 'preprocessor', 'postprocessor', 'hooks',
+              'allow_patch_many', 'allow_method_override', 'validation_exceptions',
+              'exclude_queries', 'exclude_hybrids', 'include_columns', 'exclude_columns',
+              'results_per_page', 'max_results_per_page', 'count_mode', 'max_ids_per_request', 'cache_queries',
+              'regex', 'application_name', 'attribute', 'node_code')
+
+    __slots__ = FIELDS
+
+    def __init__(self, table_name, methods, regex, **kwargs):
+        if not regex.endswith('$'):
+            regex += '$'
+        attribute = getattr(options, "attribute", "scarecrow")
+        values = dict(kwargs,
+                      table_name=table_name,
+                      methods=frozenset(method.lower() for method in methods),
+                      regex=regex,
+                      attribute=attribute,
+                      node_code=str(uuid.uuid3(uuid.NAMESPACE_DNS, str(regex + attribute))))
+        for field in self.FIELDS:
+            object.__setattr__(self, field, values.pop(field, None))
+        if values:
+            raise TypeError("unknown route settings: %s" % ", ".join(sorted(values)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RouteContext is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("RouteContext is read-only")
+
+    @property
+    def model(self):
+        """
+            The mapped class of the table, reflected once per process.
+        """
+        return registry.getModel(self.table_name)
+
+    @property
+    def primary_key(self):
+        """
+            The (first) primary key column of the table.
+        """
+        return inspector.getPrimaryKeys(self.table_name).get('constrained_columns', [])[0]
+
+    def __repr__(self):
+        return "<RouteContext %s %s>" % (self.application_name, self.regex)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: schema.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-03-21 10:12
+#         Desc: Process-wide caches of the reflected database schema.
+#      History:
+# ----------------------------------------------------------
+"""
+
+import time
+import logging
+import threading
+import scarecrow
+from tornado.options import define, options
+from sqlalchemy import Table
+from sqlalchemy import inspect as Inspect
+from sqlalchemy.orm import mapper
+
+from .cache import LRUCache
+
+define("schema_cache_ttl", default=0, help="seconds before the cached schema is reloaded, 0 means never.", type=int)
+
+# a path never resolved, None is a path without association table
+_MISSING = object()
+
+
+class ModelRegistry(object):
+    """
+        Reflects and maps every table once per process.
+
+        AlchemyWrapper used to run Table(..., autoload=True) and mapper() on a
+        brand-new class for every instance; the registry keeps the mapped class
+        so that getting a model on the request path is a dict lookup.
+    """
+
+    def __init__(self):
+        self._lock   = threading.RLock()
+        self._models = {}
+
+    @property
+    def metadata(self):
+        return scarecrow.Base.metadata
+
+    def getModel(self, table_name):
+        """
+            Return the mapped class of table_name, reflecting it on first use.
+        """
+        model = self._models.get(table_name)
+        if model is not None:
+            return model
+
+        with self._lock:
+            model = self._models.get(table_name)
+            if model is None:
+                model = self._reflect(table_name)
+                if model is not None:
+                    self._models[table_name] = model
+        return model
+
+    def getTable(self, table_name):
+        """
+            Return the reflected Table of table_name.
+        """
+        model = self.getModel(table_name)
+        return None if model is None else model.__table__
+
+    def invalidate(self, table_name=None):
+        """
+            Forget the mapped class of table_name (or of every table), the next
+            getModel() will reflect it again.
+        """
+        with self._lock:
+            if table_name is None:
+                self._models.clear()
+            else:
+                self._models.pop(table_name, None)
+
+    def refresh(self, table_name):
+        """
+            Re-reflect table_name from the database and return the new model.
+        """
+        with self._lock:
+            self._models.pop(table_name, None)
+            model = self._reflect(table_name, extend_existing=True)
+            if model is not None:
+                self._models[table_name] = model
+        inspector.invalidate(table_name)
+        return model
+
+    def _reflect(self, table_name, extend_existing=False):
+        if table_name not in self.metadata.tables:
+            logging.warning("table[%s] not in the tables!" % table_name)
+            return None
+
+        table = Table(table_name, self.metadata, autoload=True, extend_existing=extend_existing)
+        model = type(str('TableWrapper'), (object,), {'__table__': table})
+        mapper(model, table)
+        return model
+
+
+class SchemaCache(object):
+    """
+        Caches the catalog information BaseWrapper used to query on every call.
+
+        Every entry is loaded once per table and kept until invalidate() is
+        called or, when options.schema_cache_ttl is set, until it expires.
+        Callbacks registered with addListener() are told about every
+        invalidation so that derived indexes can be rebuilt.
+    """
+
+    def __init__(self):
+        self._lock       = threading.RLock()
+        self._entries    = {}
+        self._tables     = None
+        self._loaded_at  = time.time()
+        self._listeners  = []
+        self.generation  = 0
+
+    @property
+    def metadata(self):
+        return scarecrow.Base.metadata
+
+    def showTables(self):
+        """
+            Lists the tables known by the metadata.
+        """
+        self._expire()
+        tables = self._tables
+        if tables is None or len(tables) != len(self.metadata.tables):
+            with self._lock:
+                if self._tables is not None:
+                    # new models were declared, indexes built on the table list are stale.
+                    self.generation += 1
+                self._tables = tables = list(self.metadata.tables.keys())
+        return tables
+
+    def getForeignKeys(self, table):
+        return self._get('get_foreign_keys', table)
+
+    def getPrimaryKeys(self, table):
+        return self._get('get_pk_constraint', table)
+
+    def getUniqueConstraints(self, table):
+        return self._get('get_unique_constraints', table)
+
+    def getColumns(self, table):
+        return self._get('get_columns', table)
+
+    def addListener(self, callback):
+        """
+            Call callback(table_name) after every invalidation, table_name is
+            None when the whole cache was dropped.
+        """
+        self._listeners.append(callback)
+
+    def invalidate(self, table_name=None):
+        """
+            Drop the cached information of table_name (or of every table).
+        """
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+                self._tables    = None
+                self._loaded_at = time.time()
+            else:
+                for key in [key for key in self._entries if key[1] == table_name]:
+                    del self._entries[key]
+            self.generation += 1
+
+        for callback in self._listeners:
+            callback(table_name)
+
+    def _expire(self):
+        ttl = getattr(options, "schema_cache_ttl", 0)
+        if ttl and time.time() - self._loaded_at > ttl:
+            self.invalidate()
+
+    def _get(self, kind, table):
+        self._expire()
+        key = (kind, table)
+        try:
+            return self._entries[key]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = getattr(Inspect(self.metadata.bind), kind)(table)
+            return self._entries[key]
+
+
+class ForeignKeyGraph(object):
+    """
+        Index of the association tables by the set of tables they refer to.
+
+        Multi-table GETs like /api/resource/id/node used to ask the catalog for
+        the foreign keys of every table on each request. The graph is built
+        from the SchemaCache and rebuilt whenever its generation changes, so
+        resolving a path is a dict lookup.
+    """
+
+    def __init__(self, cache):
+        self._cache      = cache
+        self._lock       = threading.RLock()
+        self._generation = None
+        self._exact      = {}
+        self._referred   = {}
+        self._tables     = frozenset()
+        self._resolved   = LRUCache(1024)
+
+    def build(self):
+        """
+            (Re)build the index from the cached foreign keys.
+        """
+        with self._lock:
+            tables     = self._cache.showTables()
+            generation = self._cache.generation
+            exact      = {}
+            referred   = {}
+            for index, table in enumerate(tables):
+                fkeys = {}
+                for fk in self._cache.getForeignKeys(table):
+                    fkeys[fk['referred_table']] = fk['constrained_columns'][0]
+                if len(fkeys) == 0:
+                    continue
+
+                entry = (index, table, fkeys)
+                exact.setdefault(frozenset(fkeys), []).append(entry)
+                for referred_table in fkeys:
+                    referred.setdefault(referred_table, []).append(entry)
+
+            self._exact      = exact
+            self._referred   = referred
+            self._tables     = frozenset(tables)
+            self._resolved.clear()
+            self._generation = generation
+
+    def resolve(self, tables, superset=False):
+        """
+            Find the association table referring to exactly the given tables,
+            or to at least those tables when superset is True.
+
+            :return: (table_name, {referred_table: constrained_column}) or None
+        """
+        self._cache.showTables()
+        if self._generation != self._cache.generation:
+            self.build()
+
+        key   = (frozenset(tables), superset)
+        match = self._resolved.get(key, _MISSING)
+        if match is not _MISSING:
+            return match
+
+        wanted = key[0]
+        if superset:
+            candidates = [entry for entry in self._referred.get(next(iter(wanted)), [])
+                          if wanted.issubset(entry[2])]
+        else:
+            candidates = self._exact.get(wanted, [])
+
+        match = None
+        if len(candidates) > 0:
+            index, table, fkeys = min(candidates)
+            match = (table, fkeys)
+        # the tables of a request path are the client's, only the paths between real tables are kept
+        if wanted <= self._tables:
+            self._resolved.set(key, match)
+        return match
+
+registry  = ModelRegistry()
+inspector = SchemaCache()
+fkgraph   = ForeignKeyGraph(inspector)
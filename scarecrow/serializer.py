@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: serializer.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-01 10:05
+#         Desc: JSON serialization of the API responses.
+#      History:
+# ----------------------------------------------------------
+
+The serializer of an application is chosen by its settings:
+
+    json_backend: 'orjson', 'ujson', 'simplejson' or 'json', None picks the
+                  fastest one installed
+    json_compact: True drops the indentation and key sorting of the output
+
+orjson only exists for Python 3, so on the Python 2 interpreter scarecrow
+runs on it is never picked, and json_backend='orjson' falls back to json
+with a warning.
+"""
+
+import json
+import logging
+from datetime import date, datetime
+from json import JSONEncoder
+
+# fastest first
+BACKENDS = ('orjson', 'ujson', 'simplejson', 'json')
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return '%04d-%02d-%02d %02d:%02d:%02d' % (obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second)
+    elif isinstance(obj, date):
+        return '%04d-%02d-%02d' % (obj.year, obj.month, obj.day)
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+class DateTimeEncoder(JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, (date, datetime)):
+            return _default(obj)
+        return JSONEncoder.default(self, obj)
+
+
+def _stdlib_dumps(module, compact):
+    if compact:
+        # without indent the C accelerated encoder of the module is used
+        return lambda obj: module.dumps(obj, ensure_ascii=False, default=_default, separators=(',', ':'))
+    return lambda obj: module.dumps(obj, sort_keys=True, indent=2, ensure_ascii=False, default=_default)
+
+
+def _orjson_dumps(module, compact):
+    option = module.OPT_PASSTHROUGH_DATETIME | module.OPT_NON_STR_KEYS
+    if not compact:
+        option |= module.OPT_SORT_KEYS | module.OPT_INDENT_2
+    return lambda obj: module.dumps(obj, default=_default, option=option).decode('utf-8')
+
+
+def _ujson_dumps(module, compact):
+    if compact:
+        return lambda obj: module.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=_default)
+    return lambda obj: module.dumps(obj, sort_keys=True, indent=2, ensure_ascii=False,
+                                    escape_forward_slashes=False, default=_default)
+
+_FACTORIES = {'orjson': _orjson_dumps,
+              'ujson': _ujson_dumps,
+              'simplejson': _stdlib_dumps,
+              'json': _stdlib_dumps}
+
+
+class Serializer(object):
+    """
+        Encodes responses with the chosen JSON backend.
+
+        Dates and datetimes are written as '%Y-%m-%d' and '%Y-%m-%d %H:%M:%S'
+        whatever the backend.
+    """
+
+    def __init__(self, backend=None, compact=False):
+        self.compact = compact
+        self.backend, self.dumps = self._load(backend, compact)
+
+    @staticmethod
+    def _load(backend, compact):
+        if backend is not None and backend not in BACKENDS:
+            raise ValueError("json_backend must be one of %s" % ", ".join(BACKENDS))
+
+        for name in ([backend] if backend is not None else BACKENDS):
+            try:
+                module = __import__(name)
+                dumps  = _FACTORIES[name](module, compact)
+                # old releases of some backends have no default hook
+                dumps({"probe": datetime(2016, 1, 1)})
+                return name, dumps
+            except Exception:
+                if backend is not None:
+                    logging.warning("json_backend[%s] is not usable, falling back to json." % name)
+        return 'json', _stdlib_dumps(json, compact)
+
+
+def serializer_for(application):
+    """
+        The Serializer of a tornado application, built once from its settings.
+    """
+    serializer = getattr(application, 'scarecrow_serializer', None)
+    if serializer is None:
+        serializer = Serializer(application.settings.get('json_backend'),
+                                application.settings.get('json_compact', False))
+        application.scarecrow_serializer = serializer
+    return serializer
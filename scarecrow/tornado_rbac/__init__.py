@@ -12,24 +12,233 @@
 # ----------------------------------------------------------
 """
 
+import time
 import uuid
-import datetime
 import imp, os, re
 import logging, json
+import threading
 
 from tornado.options import define, options
 from scarecrow import AlchemyWrapper, secret_key
+from scarecrow.cache import LRUCache
+from scarecrow.wrapper import on_write
+from scarecrow.schema import registry
+from scarecrow.filters import compiler
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from .audit import auditor
+from .retention import retention
+
+define("token_cache_size", default=10000, help="the maximum number of verified tokens kept in memory.", type=int)
+define("token_cache_ttl", default=60, help="seconds a verified token and its user/role rows are trusted, 0 disables the cache.", type=int)
+define("permission_ttl", default=60, help="seconds the in-memory scepter/restrict indexes are trusted, 0 until a local write.", type=int)
+
+# token -> {"data": payload, "visitor": users rows, "role": roles rows}
+_tokens = None
+
+def token_cache():
+    """
+        The verified tokens, built on first use so that it is sized by the
+        parsed --token_cache_size.
+    """
+    global _tokens
+    if _tokens is None:
+        _tokens = LRUCache(options.token_cache_size)
+    return _tokens
+
+class PermissionMatrix(object):
+    """
+        The scepter and restrict tables indexed in memory:
+
+            denied: set of (role_code, resource_code, operation)
+            limits: {(role_code, user_code, table_name, resource_code): {"not_": constraints}}
+
+        A table is reloaded on the next lookup after a write to it through a
+        wrapper, and every permission_ttl seconds for the writes of other
+        processes. When a reload fails the previous index is kept and the
+        next lookup tries again; before the first successful load the
+        lookups raise, so the requests fail rather than go unchecked.
+    """
+
+    TABLES = ("scepter", "restrict")
 
-def recordOpt(token, opt, path, params=None, request_body=None):
-    token= AccessControl().isTokenValid(token)
-    user = AlchemyWrapper("users")
-    role = AlchemyWrapper("roles")
-    optLg= AlchemyWrapper('operation_logs')
-    if token is not None:
-        usr = user.all(code=token.get("user_code"))
-        rle = role.all(code=token.get("role_code"))
-        if len(usr)==1 and len(rle)==1 and opt.lower() in ("post", "put", "delete"):
+    def __init__(self):
+        self._lock   = threading.RLock()
+        self._loaded = {}
+        self.denied  = frozenset()
+        self.limits  = {}
+
+    def invalidate(self, table=None):
+        with self._lock:
+            # stale rather than absent, a failed reload falls back on the old index
+            for name in (self._loaded.keys() if table is None else [table]):
+                if name in self._loaded:
+                    self._loaded[name] = None
+
+    def isDenied(self, role_code, resource_code, operation):
+        self._refresh("scepter")
+        return (role_code, resource_code, operation) in self.denied
+
+    def getLimits(self, role_code, user_code, table_name, resource_code):
+        self._refresh("restrict")
+        limits = self.limits.get((role_code, user_code, table_name, resource_code))
+        if isinstance(limits, basestring):
+            # invalid JSON, fails the request like it always did
+            return {"not_": json.loads(limits)}
+        return limits
+
+    def _refresh(self, table):
+        if self._fresh(table):
+            return
+        with self._lock:
+            if not self._fresh(table):
+                try:
+                    getattr(self, "_load_" + table)()
+                except Exception:
+                    if table not in self._loaded:
+                        raise
+                    logging.exception("reloading %s failed, the previous permissions are kept." % table)
+                    return
+                self._loaded[table] = time.time()
+
+    def _fresh(self, table):
+        loaded = self._loaded.get(table)
+        return loaded is not None and (not options.permission_ttl or time.time() - loaded < options.permission_ttl)
+
+    @staticmethod
+    def _rows(table, fields):
+        # unlike all(), raises when the query fails
+        wrapper = AlchemyWrapper(table)
+        return wrapper._fetch(wrapper._query(fields), as_tuples=True)
+
+    def _load_scepter(self):
+        self.denied = frozenset(self._rows("scepter", ["role_code", "resource_code", "operation"]))
+
+    def _load_restrict(self):
+        limits = {}
+        fields = ["role_code", "user_code", "table_name", "resource_code", "constraints"]
+        for role_code, user_code, table_name, resource_code, constraints in self._rows("restrict", fields):
+            try:
+                constraints = json.loads(constraints)
+            except (TypeError, ValueError):
+                logging.error("restrict[%s, %s, %s] constraints are not JSON." % (role_code, user_code, table_name))
+                limits[(role_code, user_code, table_name, resource_code)] = constraints
+                continue
+            try:
+                # compile the filter plan now rather than on the first request
+                compiler.to_filters(registry.getModel(table_name), constraints)
+            except Exception:
+                logging.warning("restrict[%s, %s, %s] constraints do not compile." % (role_code, user_code, table_name))
+            limits[(role_code, user_code, table_name, resource_code)] = {"not_": constraints}
+        self.limits = limits
+
+permissions = PermissionMatrix()
+
+_METACHARS = set("\\.^$*+?{}[]|()")
+
+def _literal_prefix(pattern):
+    """
+        The text every path matched by pattern starts with, '' if unknown.
+    """
+    depth, escaped, klass = 0, False, False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif klass:
+            klass = char != "]"
+        elif char == "[":
+            klass = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            # a top level alternative matches paths with any prefix
+            return ""
+
+    prefix = []
+    index  = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\":
+            escape = pattern[index + 1:index + 2]
+            if not escape or escape.isalnum():
+                break
+            char, index = escape, index + 1
+        elif char in _METACHARS:
+            if char in "*?{" and prefix:
+                # the last character is optional or repeated
+                prefix.pop()
+            break
+        prefix.append(char)
+        index += 1
+    return "".join(prefix)
+
+class RouteIndex(object):
+    """
+        The routes of the application compiled once, with their resource code:
+
+            prefixes: {literal prefix: [(position, regex, res_code)]}
+
+        A path is only matched against the routes whose literal prefix it
+        starts with, one dict lookup per distinct prefix length, so the cost
+        does not grow with the number of exposed tables. Among the matching
+        routes the first registered one wins, as with the linear scan.
+    """
+
+    def __init__(self):
+        self.prefixes = {}
+        self.lengths  = ()
+        self.codes    = {}
+        self.built    = False
+
+    def build(self, apis, attribute):
+        prefixes, codes = {}, {}
+        for position, api in enumerate(apis):
+            url = api.get("url")
+            code = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(url + attribute)))
+            codes[url] = code
+            prefixes.setdefault(_literal_prefix(url), []).append((position, re.compile(url), code))
+        self.prefixes = prefixes
+        self.lengths  = sorted(set(len(prefix) for prefix in prefixes), reverse=True)
+        self.codes    = codes
+        self.built    = True
+
+    def resolve(self, path):
+        """
+            The resource code of the first route matching path, None if no route does.
+        """
+        found = None
+        for length in self.lengths:
+            for position, regex, code in self.prefixes.get(path[:length], ()):
+                if found is not None and found[0] < position:
+                    break
+                if regex.match(path):
+                    found = (position, code)
+                    break
+        return None if found is None else found[1]
+
+routes = RouteIndex()
+
+@on_write
+def _invalidate(table):
+    # drop what the caches derived from the table
+    if table in ("users", "roles"):
+        token_cache().clear()
+    elif table in PermissionMatrix.TABLES:
+        permissions.invalidate(table)
+
+def recordOpt(token, opt, path, params=None, request_body=None, unit=None):
+    if opt.lower() not in ("post", "put", "delete"):
+        return
+    control = AccessControl(unit)
+    data = control.isTokenValid(token)
+    if data is not None:
+        usr = control.getVisitor(token)
+        rle = control.getRole(token)
+        token = data
+        if len(usr)==1 and len(rle)==1:
             logs = {"operation": opt.lower(),
                     "opt_address": token.get("login_address"),
                     "request_path": path,
@@ -43,36 +252,35 @@ def recordOpt(token, opt, path, params=None, request_body=None):
             if request_body is not None:
                 logs["request_body"] = json.dumps(request_body)
 
-            optLg.insert(logs)
-            max_tms = optLg.max("created_timestamp", user_code=token.get("user_code"), role_code=token.get('role_code'))
-            if isinstance(max_tms, datetime.datetime):
-                tms = max_tms - datetime.timedelta(days=30)
-                dlt = {"filters": [{"name":"created_timestamp", "op":"<", "value":tms}]}
-                #logging.info("operation_logs[%s] will be cleared automatically." % (dlt))
-                optLg.delete(**dlt)
+            # written in batches by the audit thread, with the clean up of the old ones
+            auditor.write(logs)
 
 class AccessControl(object):
 
-    def __init__(self):
+    def __init__(self, unit=None):
+        """
+            :param unit: the UnitOfWork of the request, the wrappers share its session
+        """
         self.serial = Serializer(secret_key, expires_in=3600)
-        self.user = AlchemyWrapper("users")
-        self.scepter = AlchemyWrapper("scepter")
-        self.restrict = AlchemyWrapper("restrict")
+        self.user = AlchemyWrapper("users", unit=unit)
+        self.scepter = AlchemyWrapper("scepter", unit=unit)
+        self.restrict = AlchemyWrapper("restrict", unit=unit)
         self.attribute = getattr(options, "attribute", "scarecrow")
 
     def resetToken(self, token, login_address):
-        token = self.isTokenValid(token)
-        if token is None:
+        data = self.isTokenValid(token)
+        if data is None:
             return False
         else:
             # update
+            token_cache().pop(token)
             update_info = {"login_address":"0.0.0.0", "last_address": login_address}
-            self.user.update(update_info, code=token.get('user_code'))
+            self.user.update(update_info, code=data.get('user_code'))
             return True
 
     def createToken(self, login_address, **kwargs):
         data = {"login_address": login_address}
-        wrapper = AlchemyWrapper("users")
+        wrapper = self.user
         login_params = {"or_":[
             {'name':'username', 'op':'==', 'value':kwargs.get("username", "")},
             {'name':'nickname', 'op':'==', 'value':kwargs.get("nickname", "")},
@@ -95,23 +303,63 @@ class AccessControl(object):
             return None
 
     def isTokenValid(self, token):
-        data = None
+        context = self._context(token)
+        return None if context is None else context["data"]
+
+    def getVisitor(self, token):
+        """
+            The active users row of token (a list of one row if valid), cached with the token
+        """
+        context = self._context(token)
+        if context is None:
+            return []
+        if "visitor" not in context:
+            data = context["data"]
+            context["visitor"] = self.user.all(code=data.get("user_code"), role_code=data.get("role_code"), status=1)
+        return context["visitor"]
+
+    def getRole(self, token):
+        """
+            The roles row of token (a list of one row if valid), cached with the token
+        """
+        context = self._context(token)
+        if context is None:
+            return []
+        if "role" not in context:
+            context["role"] = AlchemyWrapper("roles", unit=self.user.unit).all(code=context["data"].get("role_code"))
+        return context["role"]
+
+    def _context(self, token):
+        """
+            Verify token once, then serve it from the cache until its expiry,
+            token_cache_ttl or a write to users/roles, whichever comes first.
+        """
+        context = token_cache().get(token) if token is not None else None
+        if context is not None:
+            return context
         try:
-            data = self.serial.loads(token)
+            data, header = self.serial.loads(token, return_header=True)
         except:
             logging.error("Token[%s] authentication failed." % token)
-        return data
+            return None
+
+        context = {"data": data}
+        ttl = options.token_cache_ttl
+        if header.get("exp") is not None:
+            ttl = min(ttl, header["exp"] - time.time())
+        if ttl > 0:
+            token_cache().set(token, context, ttl=ttl)
+        return context
 
     def getResCode(self, req_path=None, res_code=None):
         if req_path is None and res_code is None:
             return None
 
         if res_code is None:
-            for api in getattr(options, "apps", {}).get("api", []):
-                if re.match(api.get('url'), req_path):
-                    combinat = api.get("url") + self.attribute
-                    res_code = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(combinat)))
-                    break
+            if not routes.built:
+                # options.apps set up without RBAC.init_app
+                routes.build(getattr(options, "apps", {}).get("api", []), self.attribute)
+            res_code = routes.resolve(req_path)
 
         if res_code is None and req_path is not None:
             logging.warning("request path[%s] is out of the control!" % req_path)
@@ -120,6 +368,7 @@ class AccessControl(object):
             return res_code
 
     def isAccessAllowed(self, token, request_opt, login_address, req_path=None, res_code=None):
+        signed = token
         token = self.isTokenValid(token)
         logging.info("isAccessAllowed| after parse token is :%s" % token)
         if token is None \
@@ -128,7 +377,7 @@ class AccessControl(object):
                             "or token record of the login address and the actual address is not the same.)")
             return False
 
-        visitor = self.user.all(code=token.get("user_code"), role_code=token.get("role_code"), status=1)
+        visitor = self.getVisitor(signed)
         if len(visitor)!=1:
             logging.warning("Token[%s] is not illegal!!!!!" % token)
             return False
@@ -139,8 +388,7 @@ class AccessControl(object):
                 return False
 
         res_code = self.getResCode(req_path, res_code)
-        res_limit = self.scepter.all(role_code=token.get("role_code"), resource_code=res_code, operation=request_opt.lower())
-        if len(res_limit)>0:
+        if permissions.isDenied(token.get("role_code"), res_code, request_opt.lower()):
             return False
         return True
 
@@ -149,6 +397,7 @@ class AccessControl(object):
         if tkn is None or tkn.get("login_address")!=login_address:
             return False
 
+        token_cache().pop(token)
         if self.user.update({"password": new_password}, code=tkn.get("user_code")):
             self.resetToken(token, login_address)
             return True
@@ -162,6 +411,7 @@ class AccessControl(object):
                      "req_path=%s, res_code=%s, table_name=%s."
                      % (opt, token, login_address, req_path, res_code, table_name))
 
+        signed = token
         token = self.isTokenValid(token)
         logging.info("stuffParams| after parse token is :%s" % token)
         if token is None \
@@ -170,7 +420,7 @@ class AccessControl(object):
                             "or token record of the login address and the actual address is not the same.)")
             return result
 
-        visitor = self.user.all(code=token.get("user_code"), role_code=token.get("role_code"), status=1)
+        visitor = self.getVisitor(signed)
         if len(visitor)!=1:
             logging.warning("Token[%s] is not illegal!!!!!" % token)
             return result
@@ -183,14 +433,7 @@ class AccessControl(object):
                 result["valid"] = True
 
         res_code = self.getResCode(req_path, res_code)
-        restrict = AlchemyWrapper("restrict")
-        limits   = restrict.all(role_code=token.get("role_code"), user_code=token.get("user_code"))
-
-        for limit in limits:
-            if limit.get("table_name")==table_name \
-                    and limit.get("resource_code")==res_code:
-                result["limits"] = {"not_": json.loads(limit.get("constraints"))}
-                break
+        result["limits"] = permissions.getLimits(token.get("role_code"), token.get("user_code"), table_name, res_code)
         return result
 
 class RBAC(object):
@@ -221,8 +464,7 @@ class RBAC(object):
 
         attribute = getattr(options, "attribute", "scarecrow")
         for api in self.api_list.get("api"):
-            combinat  = api.get("url") + attribute
-            node_code = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(combinat)))
+            node_code = routes.codes[api.get("url")]
             node_info = {"attribute": attribute,
                          "code": node_code,
                          "resource_name": api.get("name"),
@@ -239,8 +481,13 @@ class RBAC(object):
         self.api_list = {"api": patterns}
         define("apps", default=self.api_list, help="set up the api list.")
 
+        routes.build(self.api_list["api"], getattr(options, "attribute", "scarecrow"))
+
         # second, set up the access_control flag.
         define("access_control", default=True, help="set up the access_control flag about the rbac.", type=bool)
 
         # third, initialize
         self.initialize()
+
+        # fourth, schedule the clean up of the expired operation_logs
+        retention.start()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: audit.py (tornado_rbac)
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-12 10:40
+#         Desc: Writes the operation_logs of recordOpt in the background.
+#      History:
+# ----------------------------------------------------------
+
+recordOpt puts the log rows on a bounded queue and returns. A worker thread
+takes up to audit_batch_size rows at a time (or what arrived within
+audit_flush_interval seconds) and writes them with one multi-row INSERT.
+
+When the queue is full, audit_overflow decides what happens to a new row:
+
+    sync:  it is written in the request, as with audit_async off
+    block: the request waits for room, at most audit_flush_interval seconds,
+           then writes it itself. Only the requests running on the
+           db_executor threads wait, on the IOLoop thread it would stall
+           every request, so there and without db_executor it is sync
+    drop:  it is discarded and counted in stats()["dropped"]
+
+The queue is flushed when the process exits.
+"""
+
+import time
+import atexit
+import logging
+import datetime
+import threading
+from Queue import Queue, Full, Empty
+
+from tornado.ioloop import IOLoop
+from tornado.options import define, options
+from scarecrow import engine
+from scarecrow.schema import registry
+from scarecrow.wrapper import written
+
+define("audit_async", default=True, help="write the operation_logs from a background thread.", type=bool)
+define("audit_queue_size", default=10000, help="operation_logs rows waiting to be written at most.", type=int)
+define("audit_batch_size", default=200, help="operation_logs rows per INSERT.", type=int)
+define("audit_flush_interval", default=1.0, help="seconds a row waits for its batch to fill.", type=float)
+define("audit_overflow", default='sync', help="when the audit queue is full: sync, block or drop.", type=str)
+
+OVERFLOW_POLICIES = ('sync', 'block', 'drop')
+
+TABLE_NAME = 'operation_logs'
+
+# log columns of recordOpt, a multi-row INSERT needs the same keys in every row
+COLUMNS = ("operation", "opt_address", "request_path", "user_code", "role_code", "username",
+           "role_name", "request_arguments", "request_body", "created_timestamp")
+
+_STOP = object()
+
+
+class AuditWriter(object):
+
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._queue   = None
+        self._worker  = None
+        self.queued   = 0
+        self.written  = 0
+        self.dropped  = 0
+        self.failed   = 0
+        self.batches  = 0
+
+    def write(self, logs):
+        """
+            Queue one operation_logs row, or write it now if audit_async is off.
+        """
+        row = dict((column, logs.get(column)) for column in COLUMNS)
+        if row["created_timestamp"] is None:
+            # the time of the request, not of the flush
+            row["created_timestamp"] = datetime.datetime.now()
+
+        if not options.audit_async:
+            self._insert([row])
+            return
+
+        self._start()
+        try:
+            if options.audit_overflow == 'block' and self._may_block():
+                self._queue.put(row, timeout=options.audit_flush_interval)
+            else:
+                self._queue.put_nowait(row)
+            self.queued += 1
+        except Full:
+            if options.audit_overflow == 'drop':
+                self.dropped += 1
+                logging.warning("audit queue is full, operation_logs of %s dropped." % row["request_path"])
+            else:
+                self._insert([row])
+
+    @staticmethod
+    def _may_block():
+        """
+            Whether the calling thread may wait for the queue, not the IOLoop's.
+        """
+        return options.db_executor and IOLoop.current(instance=False) is None
+
+    def _start(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is not None:
+                return
+            if options.audit_overflow not in OVERFLOW_POLICIES:
+                raise ValueError("audit_overflow must be one of %s" % ", ".join(OVERFLOW_POLICIES))
+            self._queue  = Queue(options.audit_queue_size)
+            self._worker = threading.Thread(target=self._run, name="audit-writer")
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            rows = [self._queue.get()]
+            deadline = time.time() + options.audit_flush_interval
+            while len(rows) < options.audit_batch_size:
+                try:
+                    rows.append(self._queue.get(timeout=max(deadline - time.time(), 0)))
+                except Empty:
+                    break
+            if any(row is _STOP for row in rows):
+                # the rows dequeued after the marker are written too, flush() only sees the queue
+                stop = True
+                rows = [row for row in rows if row is not _STOP]
+            if rows:
+                self._insert(rows)
+
+    def _insert(self, rows):
+        table  = registry.getTable(TABLE_NAME)
+        stored = 0
+        try:
+            engine.execute(table.insert().values(rows))
+            stored = len(rows)
+        except Exception:
+            logging.exception("operation_logs batch of %d rows failed, writing them one by one." % len(rows))
+            for row in rows:
+                try:
+                    engine.execute(table.insert(), row)
+                except Exception:
+                    self.failed += 1
+                    logging.exception("operation_logs of %s lost." % row["request_path"])
+                else:
+                    stored += 1
+        self.written += stored
+        self.batches += 1
+        if stored:
+            written(TABLE_NAME)
+
+    def flush(self, timeout=None):
+        """
+            Write the queued rows and stop the worker, a later write starts a new one.
+        """
+        with self._lock:
+            worker, queue = self._worker, self._queue
+            self._worker = None
+        if worker is None:
+            return
+        queue.put(_STOP)
+        worker.join(timeout)
+        # rows queued after the stop marker
+        rows = []
+        while True:
+            try:
+                rows.append(queue.get_nowait())
+            except Empty:
+                break
+        rows = [row for row in rows if row is not _STOP]
+        if rows:
+            self._insert(rows)
+
+    def stats(self):
+        return {"async": options.audit_async,
+                "overflow": options.audit_overflow,
+                "pending": self._queue.qsize() if self._queue is not None else 0,
+                "queued": self.queued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "batches": self.batches}
+
+
+auditor = AuditWriter()
+atexit.register(auditor.flush)
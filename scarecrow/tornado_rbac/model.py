@@ -70,12 +70,12 @@ class OperationLogs(Base):
     username          = Column(String(36), nullable=False) # 用户名
     role_name         = Column(String(64), nullable=False)
     operation         = Column(String(36), nullable=False, default="post") # post/put/delete
-    user_code         = Column(String(36), ForeignKey(Users.code, ondelete='CASCADE', onupdate='CASCADE'))
+    user_code         = Column(String(36), ForeignKey(Users.code, ondelete='CASCADE', onupdate='CASCADE'), index=True)
     role_code         = Column(String(36), ForeignKey(Roles.code, ondelete='CASCADE', onupdate='CASCADE'))
     opt_address       = Column(String(64), nullable=False, default='127.0.0.1')
     request_arguments = Column(String(1024))
     request_body      = Column(Text)
     request_path      = Column(String(512), nullable=False)
-    created_timestamp = Column(DateTime, default=datetime.datetime.now)
+    created_timestamp = Column(DateTime, default=datetime.datetime.now, index=True) # 保留期限清理
 
 Base.metadata.create_all(engine)
\ No newline at end of file
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: retention.py (tornado_rbac)
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-13 17:10
+#         Desc: Periodic removal of the expired operation_logs.
+#      History:
+# ----------------------------------------------------------
+
+Every audit_retention_interval seconds the rows of operation_logs older than
+audit_retention_days are deleted, audit_retention_chunk rows per statement
+and transaction, so the job never holds long locks. The job runs on the
+database executor, off the IOLoop when --db_executor is on.
+
+With --audit_partitioning on PostgreSQL 11+ (and a SQLAlchemy that reflects
+partitioned tables, 1.3+), operation_logs is converted to a table partitioned
+by month of created_timestamp. The job then keeps the partitions of this
+month and the next one created, and drops a whole partition once all its
+rows have expired.
+"""
+
+import logging
+import datetime
+import sqlalchemy
+from sqlalchemy import select, text
+from sqlalchemy.engine.reflection import Inspector
+from tornado.ioloop import PeriodicCallback
+from tornado.options import define, options
+
+from scarecrow import Base, engine
+from scarecrow.executor import executor
+from scarecrow.schema import registry, inspector
+from scarecrow.wrapper import written
+
+define("audit_retention_days", default=30, help="days the operation_logs are kept, 0 keeps them forever.", type=int)
+define("audit_retention_interval", default=3600, help="seconds between two runs of the operation_logs retention.", type=int)
+define("audit_retention_chunk", default=5000, help="expired operation_logs rows deleted per statement.", type=int)
+define("audit_partitioning", default=False, help="partition operation_logs by month (PostgreSQL 11+, SQLAlchemy 1.3+).", type=bool)
+
+TABLE_NAME = 'operation_logs'
+
+
+def _month(day):
+    return datetime.datetime(day.year, day.month, 1)
+
+
+def _next_month(day):
+    return datetime.datetime(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+class RetentionJob(object):
+
+    def __init__(self):
+        self._callback = None
+        self._running  = False
+        self.runs      = 0
+        self.deleted   = 0
+        self.dropped   = []
+
+    def start(self):
+        """
+            Create the missing indexes (and partitions), then schedule the job on the current IOLoop.
+        """
+        self.ensure_indexes()
+        if options.audit_partitioning:
+            self.ensure_partitioning()
+        if options.audit_retention_days <= 0 or self._callback is not None:
+            return
+        self._callback = PeriodicCallback(self._tick, options.audit_retention_interval * 1000)
+        self._callback.start()
+
+    def stop(self):
+        if self._callback is not None:
+            self._callback.stop()
+            self._callback = None
+
+    def _tick(self):
+        if self._running:
+            return
+        self._running = True
+        future = executor.submit(self.run_once)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self._running = False
+        if future.exception() is not None:
+            logging.error("operation_logs retention failed: %s" % future.exception())
+
+    def run_once(self, now=None):
+        """
+            Remove the expired rows, return how many were deleted.
+        """
+        if options.audit_retention_days <= 0:
+            return 0
+        cutoff = (now or datetime.datetime.now()) - datetime.timedelta(days=options.audit_retention_days)
+        if options.audit_partitioning and self.is_partitioned():
+            self.ensure_partitions(now)
+            self.drop_partitions(cutoff)
+
+        table   = registry.getTable(TABLE_NAME)
+        expired = select([table.c.id]).where(table.c.created_timestamp < cutoff).limit(options.audit_retention_chunk)
+        number  = 0
+        while True:
+            with engine.begin() as connection:
+                ids = [row[0] for row in connection.execute(expired)]
+                if ids:
+                    connection.execute(table.delete().where(table.c.id.in_(ids)))
+            number += len(ids)
+            if len(ids) < options.audit_retention_chunk:
+                break
+
+        self.runs    += 1
+        self.deleted += number
+        if number:
+            logging.info("operation_logs retention: %d rows older than %s deleted." % (number, cutoff))
+            written(TABLE_NAME)
+        return number
+
+    def ensure_indexes(self):
+        """
+            Create the indexes of the model that an older database lacks.
+        """
+        table    = Base.metadata.tables.get(TABLE_NAME)
+        existing = set(index['name'] for index in Inspector.from_engine(engine).get_indexes(TABLE_NAME))
+        for index in (table.indexes if table is not None else []):
+            if index.name not in existing:
+                logging.info("creating index %s on %s." % (index.name, TABLE_NAME))
+                index.create(engine)
+
+    # PostgreSQL partitioning
+
+    def is_partitioned(self):
+        if engine.dialect.name != 'postgresql':
+            return False
+        return engine.execute(text("SELECT count(*) FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+                                   "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"),
+                              name=TABLE_NAME).scalar() > 0
+
+    def ensure_partitioning(self):
+        """
+            Convert operation_logs into a table partitioned by month, once.
+        """
+        if engine.dialect.name != 'postgresql' or engine.dialect.server_version_info < (11,):
+            logging.warning("audit_partitioning needs PostgreSQL 11 or later, operation_logs is left as it is.")
+            return
+        if tuple(int(part) for part in sqlalchemy.__version__.split('.')[:2]) < (1, 3):
+            # an older one cannot reflect a partitioned table, operation_logs would be unusable
+            logging.warning("audit_partitioning needs SQLAlchemy 1.3 or later, operation_logs is left as it is.")
+            return
+        if self.is_partitioned():
+            self.ensure_partitions()
+            return
+
+        legacy = TABLE_NAME + '_unpartitioned'
+        with engine.begin() as connection:
+            first = connection.execute(text("SELECT min(created_timestamp) FROM %s" % TABLE_NAME)).scalar()
+            connection.execute(text("UPDATE %s SET created_timestamp = now() WHERE created_timestamp IS NULL" % TABLE_NAME))
+            foreign_keys = connection.execute(text("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                                                   "WHERE conrelid = '%s'::regclass AND contype = 'f'"
+                                                   % TABLE_NAME)).fetchall()
+            connection.execute(text("ALTER TABLE %s RENAME TO %s" % (TABLE_NAME, legacy)))
+            connection.execute(text("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY RANGE (created_timestamp)"
+                                    % (TABLE_NAME, legacy)))
+            connection.execute(text("ALTER SEQUENCE %s_id_seq OWNED BY %s.id" % (TABLE_NAME, TABLE_NAME)))
+            connection.execute(text("CREATE TABLE %s_default PARTITION OF %s DEFAULT" % (TABLE_NAME, TABLE_NAME)))
+            self._create_partitions(connection, first or datetime.datetime.now(), _next_month(datetime.datetime.now()))
+            connection.execute(text("INSERT INTO %s SELECT * FROM %s" % (TABLE_NAME, legacy)))
+            connection.execute(text("DROP TABLE %s" % legacy))
+            # once the old table and its operation_logs_pkey are gone
+            connection.execute(text("ALTER TABLE %s ADD PRIMARY KEY (id, created_timestamp)" % TABLE_NAME))
+            # the logs still go with their users and roles (ON DELETE CASCADE)
+            for name, definition in foreign_keys:
+                connection.execute(text("ALTER TABLE %s ADD CONSTRAINT %s %s" % (TABLE_NAME, name, definition)))
+        logging.info("operation_logs is now partitioned by month.")
+
+        registry.invalidate(TABLE_NAME)
+        inspector.invalidate(TABLE_NAME)
+        self.ensure_indexes()
+
+    def ensure_partitions(self, now=None):
+        """
+            Create the partitions of this month and the next one.
+        """
+        now = now or datetime.datetime.now()
+        with engine.begin() as connection:
+            self._create_partitions(connection, now, _next_month(now))
+
+    @staticmethod
+    def _create_partitions(connection, first, last):
+        month = _month(first)
+        while month <= last:
+            upper = _next_month(month)
+            connection.execute(text("CREATE TABLE IF NOT EXISTS %s_p%04d%02d PARTITION OF %s "
+                                    "FOR VALUES FROM ('%s') TO ('%s')"
+                                    % (TABLE_NAME, month.year, month.month, TABLE_NAME,
+                                       month.strftime('%Y-%m-%d'), upper.strftime('%Y-%m-%d'))))
+            month = upper
+
+    def drop_partitions(self, cutoff):
+        """
+            Drop the monthly partitions whose rows are all older than cutoff.
+        """
+        partitions = engine.execute(text("SELECT c.relname FROM pg_inherits i "
+                                         "JOIN pg_class c ON c.oid = i.inhrelid "
+                                         "JOIN pg_class p ON p.oid = i.inhparent "
+                                         "WHERE p.relname = :name"), name=TABLE_NAME).fetchall()
+        prefix = TABLE_NAME + '_p'
+        for (name,) in partitions:
+            if not name.startswith(prefix):
+                continue
+            try:
+                month = datetime.datetime.strptime(name[len(prefix):], '%Y%m')
+            except ValueError:
+                continue
+            if _next_month(month) <= cutoff:
+                with engine.begin() as connection:
+                    connection.execute(text("DROP TABLE %s" % name))
+                self.dropped.append(name)
+                logging.info("operation_logs partition %s dropped." % name)
+
+    def stats(self):
+        return {"runs": self.runs,
+                "deleted": self.deleted,
+                "dropped_partitions": list(self.dropped),
+                "partitioned": options.audit_partitioning}
+
+
+retention = RetentionJob()
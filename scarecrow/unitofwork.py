@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: unitofwork.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-08 15:30
+#         Desc: One database session for all the wrappers of a request.
+#      History:
+# ----------------------------------------------------------
+
+    unit = UnitOfWork()
+    users = AlchemyWrapper("users", unit=unit)
+    logs  = AlchemyWrapper("operation_logs", unit=unit)
+    with unit.grouped():
+        users.update(...)
+        logs.insert(...)
+    unit.close()
+"""
+
+import scarecrow
+from contextlib import contextmanager
+
+from .wrapper import written
+
+
+class UnitOfWork(object):
+    """
+        The session shared by the wrappers of one request.
+
+        The wrappers built with unit=self run on the same session, so a
+        request checks out one connection per transaction instead of one
+        per wrapper. close() releases it at once rather than when the
+        wrappers are garbage collected. The checkouts of a request are the
+        difference of pool_stats()['checkouts'] before and after it.
+
+        Inside grouped() the commits of the wrappers only flush, and the
+        outermost block commits them together. If any write of the block
+        fails, the block ends with a rollback. The write listeners of the
+        tables are only told once the block is committed.
+    """
+
+    def __init__(self):
+        self.session  = scarecrow.Session()
+        self.grouping = 0
+        self.failed   = False
+        self.tables   = set()
+
+    def commit(self, table=None):
+        """
+            Commit the writes made to table, only flush them inside grouped()
+        """
+        if self.grouping:
+            self.session.flush()
+            self.tables.add(table)
+        else:
+            self.session.commit()
+            written(table)
+
+    def rollback(self):
+        self.session.rollback()
+        if self.grouping:
+            self.failed = True
+
+    @contextmanager
+    def grouped(self):
+        """
+            Commit the writes of the block together, or none of them.
+        """
+        self.grouping += 1
+        try:
+            yield self
+        except:
+            self.failed = True
+            raise
+        finally:
+            self.grouping -= 1
+            if self.grouping == 0:
+                failed, self.failed = self.failed, False
+                tables, self.tables = self.tables, set()
+                if failed:
+                    self.session.rollback()
+                else:
+                    self.session.commit()
+                    written(*tables)
+
+    def close(self):
+        self.session.close()
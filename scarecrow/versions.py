@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# ----------------------------------------------------------
+#     FileName: versions.py
+#       Author: wangdean
+#        Email: wangdean@sowell-tech.com
+#      Version: 0.7.1
+#   LastChange: 2016-04-18 14:20
+#         Desc: Per-table version counters, the ETags of the GET responses.
+#      History:
+# ----------------------------------------------------------
+
+Every committed write through an AlchemyWrapper (or a UnitOfWork, the audit
+writer, the retention job) bumps the version of its table. The ETag of a GET
+is a digest of the versions of the tables it reads and of the request, so a
+client sending it back in If-None-Match gets a 304 without a query as long
+as none of those tables was written.
+
+The counters only see the writes of this process. The ETags also change
+every etag_max_age seconds, which bounds how long the writes of other
+processes (or made outside scarecrow) go unnoticed. 0 trusts the counters
+alone, for a single process that owns its database.
+"""
+
+import time
+import uuid
+import hashlib
+import threading
+from tornado.options import define, options
+
+from .wrapper import on_write
+
+define("etag", default=True, help="answer the GETs with version ETags and If-None-Match with 304.", type=bool)
+define("etag_max_age", default=60, help="seconds a version ETag stays valid, 0 until a local write.", type=int)
+
+
+class TableVersions(object):
+    """
+        A counter per table, starting at 0 in every process. The epoch of the
+        process is part of the ETags, so two processes never hand out the
+        same ETag for different contents.
+    """
+
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._counter = {}
+        self.epoch    = uuid.uuid4().hex
+
+    def bump(self, table):
+        with self._lock:
+            self._counter[table] = self._counter.get(table, 0) + 1
+
+    def get(self, table):
+        return self._counter.get(table, 0)
+
+    def etag(self, tables, *parts):
+        """
+            The ETag of a response built from tables, parts tell the requests apart.
+        """
+        window = int(time.time() // options.etag_max_age) if options.etag_max_age > 0 else 0
+        digest = hashlib.md5("%s:%d" % (self.epoch, window))
+        for table in sorted(set(tables)):
+            digest.update("\0%s=%d" % (table, self.get(table)))
+        for part in parts:
+            digest.update("\0" + (part.encode("utf-8") if isinstance(part, unicode) else str(part)))
+        return '"%s"' % digest.hexdigest()
+
+    def stats(self):
+        return dict(self._counter)
+
+
+versions = TableVersions()
+
+@on_write
+def _bump(table):
+    versions.bump(table)
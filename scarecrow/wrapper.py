@@ -17,10 +17,43 @@ import uuid
 import json
 import logging
 import scarecrow
+from tornado.options import define, options
 from sqlalchemy.sql.expression import or_, not_
-from sqlalchemy import Table, desc, asc, func
-from sqlalchemy.orm import mapper
-from sqlalchemy import inspect as Inspect
+from sqlalchemy import desc, asc, func
+from .cache import LRUCache
+from .schema import registry, inspector
+from .filters import compiler
+from .pagination import keyset_filter, encode_cursor
+from .errors import IllegalArgumentError
+from .querycache import querycache, WRITTEN_TABLES
+
+define("count_cache_ttl", default=60, help="seconds a cached count(count=cached) is served.", type=int)
+define("count_cache_size", default=4096, help="the maximum number of cached counts.", type=int)
+define("insert_batch_size", default=500, help="objects per executemany of a POSTed array.", type=int)
+define("pk_chunk_size", default=500, help="primary keys per statement of a batched PUT/DELETE.", type=int)
+
+# How num_results of a paginated GET is produced
+COUNT_MODES = ('exact', 'cached', 'estimate', 'none')
+
+# callbacks(table_name) run after a write through a wrapper is committed
+_write_listeners = []
+
+def on_write(callback):
+    """
+        Register callback(table_name), called after every committed write
+        made through an AlchemyWrapper, e.g. to drop what a cache knows
+        about the table.
+    """
+    _write_listeners.append(callback)
+    return callback
+
+def written(*tables):
+    for table in tables:
+        for callback in _write_listeners:
+            try:
+                callback(table)
+            except:
+                logging.exception("write listener of table[%s] failed." % table)
 
 class BaseWrapper(object):
     def __init__(self):
@@ -33,140 +66,54 @@ class BaseWrapper(object):
         """
             Lists the non-TEMPORARY tables in a given database.
         """
-        return self.metadata.tables.keys()
+        return inspector.showTables()
 
     def getForeignKeys(self, table):
         """
             Return information about foreign_keys in table_name.
         """
-        return Inspect(self.metadata.bind).get_foreign_keys(table)
+        return inspector.getForeignKeys(table)
 
     def getPrimaryKeys(self, table):
         """
             Return information about primary key constraint on table_name.
         """
-        return Inspect(self.metadata.bind).get_pk_constraint(table)
+        return inspector.getPrimaryKeys(table)
 
     def getUniqueConstraints(self, table):
         """
             Return information about unique constraints in table_name.
         """
-        return Inspect(self.metadata.bind).get_unique_constraints(table)
+        return inspector.getUniqueConstraints(table)
 
     def getColumns(self, table):
         """
             Return information about columns in table_name.
         """
-        return Inspect(self.metadata.bind).get_columns(table)
+        return inspector.getColumns(table)
+
+    def invalidate(self, table=None):
+        """
+            Forget the cached schema information of table (or of every table).
+        """
+        inspector.invalidate(table)
 
 class AlchemyWrapper(object):
 
     def getModel(self, table):
-        model = None
-        if table in self.base.showTables():
-            class TableWrapper(object):pass
-            table = Table(table, self.metadata, autoload=True)
-            mapper(TableWrapper, table)
-            model = TableWrapper
-        else:
-            logging.warning("table[%s] not in the tables!" % table)
-        return model
+        """
+            Return the mapped class of table, reflected once per process.
+        """
+        return registry.getModel(table)
 
     def to_filters(self, instance, argument_filters):
-        if isinstance(argument_filters, list)==False:
-            argument_filters = json.loads(argument_filters)
+        """
+            Compile argument_filters against instance (a mapped class).
 
+            :raise: IllegalArgumentError on unknown fields or operators
+        """
         logging.info("to_filters| argument_filters = %s" % argument_filters)
-
-        # Create Alchemy Filters
-        alchemy_filters = []
-        for argument_filter in argument_filters:
-            # Resolve right attribute
-            if "val" in argument_filter.keys():
-                right = argument_filter["val"]
-            elif "value" in argument_filter.keys():  # Because we hate abbr sometimes ...
-                right = argument_filter["value"]
-            else:
-                right = None
-
-            # Operator
-            op = argument_filter["op"]
-            if op in ["like"]:
-                right = '%' + right + '%'
-
-            # Resolve left attribute
-            if "name" not in argument_filter:
-                logging.warning("Missing fieldname attribute 'name'")
-
-            if argument_filter["name"] == "~":
-                left = instance
-                op = "attr_is"
-            else:
-                left = getattr(instance, argument_filter["name"])
-
-            # Operators from flask-restless
-            if op in ["is_null"]:
-                alchemy_filters.append(left.is_(None))
-            elif op in ["is_not_null"]:
-                alchemy_filters.append(left.isnot(None))
-            elif op in ["is"]:
-                alchemy_filters.append(left.is_(right))
-            elif op in ["is_not"]:
-                alchemy_filters.append(left.isnot(right))
-            elif op in ["==", "eq", "equals", "equals_to"]:
-                alchemy_filters.append(left == right)
-            elif op in ["!=", "ne", "neq", "not_equal_to", "does_not_equal"]:
-                alchemy_filters.append(left != right)
-            elif op in [">", "gt"]:
-                alchemy_filters.append(left > right)
-            elif op in ["<", "lt"]:
-                alchemy_filters.append(left < right)
-            elif op in [">=", "ge", "gte", "geq"]:
-                alchemy_filters.append(left >= right)
-            elif op in ["<=", "le", "lte", "leq"]:
-                alchemy_filters.append(left <= right)
-            elif op in ["ilike"]:
-                alchemy_filters.append(left.ilike(right))
-            elif op in ["not_ilike"]:
-                alchemy_filters.append(left.notilike(right))
-            elif op in ["like"]:
-                alchemy_filters.append(left.like(right))
-            elif op in ["not_like"]:
-                alchemy_filters.append(left.notlike(right))
-            elif op in ["match"]:
-                alchemy_filters.append(left.match(right))
-            elif op in ["in"]:
-                alchemy_filters.append(left.in_(right))
-            elif op in ["not_in"]:
-                alchemy_filters.append(left.notin_(right))
-            elif op in ["has"] and isinstance(right, list):
-                alchemy_filters.append(left.any(*right))
-            elif op in ["has"]:
-                alchemy_filters.append(left.has(right))
-            elif op in ["any"]:
-                alchemy_filters.append(left.any(right))
-            # Additional Operators
-            elif op in ["between"]:
-                alchemy_filters.append(left.between(*right))
-            elif op in ["contains"]:
-                alchemy_filters.append(left.contains(right))
-            elif op in ["startswith"]:
-                alchemy_filters.append(left.startswith(right))
-            elif op in ["endswith"]:
-                alchemy_filters.append(left.endswith(right))
-            # Additional Checks
-            elif op in ["attr_is"]:
-                alchemy_filters.append(getattr(left, right))
-            elif op in ["method_is"]:
-                alchemy_filters.append(getattr(left, right)())
-            # Test comparator
-            elif hasattr(left.comparator, op):
-                alchemy_filters.append(getattr(left.comparator, op)(right))
-            # Raise Exception
-            else:
-                logging.warning("Unknown operator")
-
-        return alchemy_filters
+        return compiler.to_filters(instance, argument_filters)
 
     def _apply_kwargs(self, instance, **kwargs):
 
@@ -183,25 +130,24 @@ class AlchemyWrapper(object):
             else:
                 operator = "or_"
                 argument_filters = kwargs.pop('or_')
-            if isinstance(argument_filters, list)==False:
-                argument_filters = json.loads(argument_filters)
-            alchemy_list = []
-            for filters in argument_filters:
-                alchemy_list += self.to_filters(self.model, [filters])
+            alchemy_list = self.to_filters(self.model, argument_filters)
 
             if operator=="not_":
                 instance = instance.filter(not_(*alchemy_list))
             else:
                 instance = instance.filter(or_(*alchemy_list))
 
+        keyset = 'after' in kwargs
+        after  = kwargs.pop('after', None)
         if 'order_by' in kwargs or 'direction' in kwargs:
-            criterion = kwargs.pop('order_by')
-            direction = kwargs.pop('direction')
-            if direction == 'asc':
-                expression = asc(getattr(self.model, criterion))
-            else:
-                expression = desc(getattr(self.model, criterion))
-            instance = instance.order_by(expression)
+            criterion = kwargs.pop('order_by', None) or self.primary_key()
+            direction = kwargs.pop('direction', 'asc')
+            keys      = self.keyset_columns(criterion) if keyset else [criterion]
+            columns   = [getattr(self.model, key) for key in keys]
+            if after is not None:
+                instance = instance.filter(keyset_filter(columns, after, direction))
+            order    = asc if direction == 'asc' else desc
+            instance = instance.order_by(*[order(column) for column in columns])
 
         if 'offset' in kwargs:
             offset = kwargs.pop('offset')
@@ -220,6 +166,21 @@ class AlchemyWrapper(object):
         instance = flimit(instance)
         return instance
 
+    def keyset_columns(self, criterion, table=''):
+        """
+            The columns a keyset page is sorted on: the order_by column plus
+            the primary key as a tiebreak.
+        """
+        pkey = self.primary_key(table)
+        return [criterion] if criterion == pkey else [criterion, pkey]
+
+    def primary_key(self, table=''):
+        """
+            The (first) primary key column of table.
+        """
+        table = table if len(table)>0 else self.tablename
+        return self.base.getPrimaryKeys(table).get('constrained_columns', [])[0]
+
     def logging_error(self):
         exc_type, exc_value = sys.exc_info()[:2]
         logging.error("exc_type=%s, message=%s" % (exc_type.__module__ + "." + exc_type.__name__, exc_value))
@@ -227,33 +188,66 @@ class AlchemyWrapper(object):
     def to_dict(self, obj_dict):
         return dict((key, obj_dict[key]) for key in obj_dict if not key.startswith("_"))
 
-    def __init__(self, table_name):
+    def __init__(self, table_name, unit=None, cache=False, model=None):
+        """
+            :param table_name:
+            :param unit: a UnitOfWork whose session is shared with the other
+                         wrappers of the request, a session of its own if None
+            :param cache: serve the read queries from the query result cache
+            :param model: the mapped class of table_name when the caller has it already
+        """
         self.res_dict  = {}
         self.tablename = table_name
         self.Session   = scarecrow.Session
         self.Base      = scarecrow.Base
         self.engine    = scarecrow.engine
         self.metadata  = self.Base.metadata
-        self.session   = self.Session()
+        self.unit      = unit
+        self.cache     = cache
+        self.session   = self.Session() if unit is None else unit.session
         self.base      = BaseWrapper()
-        self.model     = self.getModel(table_name)
+        self.model     = model if model is not None else self.getModel(table_name)
 
     def __del__(self):
-        self.session.close()
+        # a shared session is closed by its unit of work
+        if self.unit is None:
+            self.session.close()
+
+    def commit(self):
+        """
+            Commit the session, or only flush it while the unit of work groups commits.
+        """
+        if self.unit is None:
+            self.session.commit()
+            written(self.tablename)
+        else:
+            self.unit.commit(self.tablename)
+
+    def rollback(self):
+        if self.unit is None:
+            self.session.rollback()
+        else:
+            self.unit.rollback()
 
     def max(self, table_column, **kwargs):
         instance = self.session.query(func.max(getattr(self.model, table_column)))
         return self._apply_kwargs(instance, **kwargs).scalar()
 
+    def new_code(self, metadata):
+        """
+            The code of a new row: derived from the name for roles and users,
+            random otherwise
+        """
+        if self.tablename in ("roles", "users"):
+            name = metadata.get("role_name") if metadata.has_key("role_name") else metadata.get("username")
+            return str(uuid.uuid3(uuid.NAMESPACE_DNS, str(name)))
+        return str(uuid.uuid4())
+
     def insert(self, metadata):
         instance = self.model()
         try:
             if metadata.has_key('code') == False and hasattr(instance, 'code'):
-                if self.tablename in ("roles", "users"):
-                    name = metadata.get("role_name") if metadata.has_key("role_name") else metadata.get("username")
-                    setattr(instance, 'code', str(uuid.uuid3(uuid.NAMESPACE_DNS, str(name))))
-                else:
-                    setattr(instance, 'code', str(uuid.uuid4()))
+                setattr(instance, 'code', self.new_code(metadata))
 
             for key, value in metadata.items():
                 if hasattr(instance, key):
@@ -265,54 +259,288 @@ class AlchemyWrapper(object):
             # To Dict
             result = self.to_dict(instance.__dict__)
             # Commit
-            self.session.commit()
+            self.commit()
             result["errorcode"] = 1
         except:
             self.logging_error()
             # print(traceback.format_exc())
-            self.session.rollback()
+            self.rollback()
             result = {'errorcode':0}
         return result
 
+    def insert_many(self, items, batch_size=None):
+        """
+            Insert a list of objects with one executemany per batch, each
+            batch in its own transaction
+
+            When a batch fails it is rolled back and its objects are inserted
+            one by one with insert(), so that only the faulty ones are lost.
+
+            :return: one result per object, in order, with its errorcode. On
+                     PostgreSQL the stored row like insert() (generated keys and
+                     defaults included), elsewhere the columns sent and the code
+        """
+        batch_size = batch_size or options.insert_batch_size
+        columns    = set(self.model.__table__.columns.keys())
+        returning  = self.engine.dialect.name == 'postgresql'
+
+        mappings = []
+        for metadata in items:
+            mapping = dict((key, value) for key, value in metadata.items() if key in columns)
+            if 'code' in columns and not mapping.has_key('code'):
+                mapping['code'] = self.new_code(metadata)
+            mappings.append(mapping)
+
+        result = []
+        for start in range(0, len(mappings), batch_size):
+            # copies, the mappings stay as sent for the retry of a failed batch
+            batch = [dict(mapping) for mapping in mappings[start:start + batch_size]]
+            try:
+                if returning:
+                    stored = self._insert_returning(batch)
+                else:
+                    self.session.bulk_insert_mappings(self.model, batch)
+                    stored = batch
+                self.commit()
+            except:
+                self.logging_error()
+                self.rollback()
+                result.extend(self.insert(dict(mapping)) for mapping in mappings[start:start + batch_size])
+                continue
+            result.extend(dict(row, errorcode=1) for row in stored)
+        return result
+
+    def _insert_returning(self, batch):
+        """
+            Insert batch with multi-row INSERT ... VALUES ... RETURNING, one
+            statement per run of mappings with the same columns.
+
+            :return: the stored rows, in the order of batch
+        """
+        table  = self.model.__table__
+        stored = []
+        start  = 0
+        while start < len(batch):
+            keys = set(batch[start])
+            end  = start + 1
+            while end < len(batch) and set(batch[end]) == keys:
+                end += 1
+            rows = self.session.execute(table.insert().values(batch[start:end]).returning(*table.columns))
+            names = rows.keys()
+            stored.extend(dict(zip(names, row)) for row in rows)
+            start = end
+        return stored
+
+    def _cached(self, method, arguments, compute, tables=None):
+        """
+            compute() through the query cache, if this wrapper uses it and its
+            session has no uncommitted writes that the result could see.
+        """
+        if not self.cache or self.session.info.get(WRITTEN_TABLES):
+            return compute()
+        key = querycache.key(method, self.tablename, arguments)
+        return querycache.fetch(key, tables or (self.tablename,), compute)
+
     def count(self, **kwargs):
         instance = self.session.query(self.model)
-        return self._apply_kwargs(instance, **kwargs).count()
+        return self._cached('count', kwargs, lambda: self._apply_kwargs(instance, **kwargs).count())
+
+    def total(self, count_mode='exact', **kwargs):
+        """
+            Count the rows matching kwargs according to count_mode
 
-    def get(self, *pargs):
+            :param count_mode: one of COUNT_MODES
+            :return: (number or None, the count_mode that produced it)
+        """
+        if count_mode == 'none':
+            return None, count_mode
+        signature = (self.tablename, kwargs)
+        return self._cached('total', [count_mode, kwargs],
+                            lambda: self._total(self._apply_kwargs(self.session.query(self.model), **kwargs),
+                                                count_mode, signature))
+
+    def _total(self, instance, count_mode, signature):
+        if count_mode == 'none':
+            return None, count_mode
+
+        if count_mode == 'estimate':
+            number = self._estimate(instance)
+            if number is not None:
+                return number, count_mode
+            count_mode = 'exact'
+
+        if count_mode == 'cached':
+            key    = json.dumps(signature, sort_keys=True, default=str)
+            number = count_cache().get(key)
+            if number is None:
+                number = instance.count()
+                count_cache().set(key, number, ttl=options.count_cache_ttl)
+            return number, count_mode
+
+        return instance.count(), 'exact'
+
+    def _estimate(self, instance):
+        """
+            Return the planner's row estimate of instance, None when the
+            database can't tell it.
+        """
+        if self.engine.dialect.name != 'postgresql':
+            return None
+        try:
+            compiled = instance.statement.compile(dialect=self.engine.dialect)
+            # on a connection of its own, a failed EXPLAIN must not abort the transaction of the session
+            with self.engine.connect() as connection:
+                plan = connection.execute("EXPLAIN (FORMAT JSON) %s" % compiled, compiled.params).scalar()
+            if not isinstance(plan, list):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        except:
+            self.logging_error()
+            return None
+
+    def _query(self, fields=None):
+        """
+            Query the whole entity, or only the given columns.
+        """
+        if fields:
+            return self.session.query(*[getattr(self.model, field) for field in fields])
+        return self.session.query(self.model)
+
+    def _fetch(self, instance, as_tuples=False):
+        """
+            Run the SELECT of a query on the session's connection and map the
+            rows straight to dicts (or tuples), skipping entity construction
+            and the identity map.
+        """
+        result = self.session.execute(instance.statement)
+        if as_tuples:
+            return [tuple(row) for row in result]
+        keys = result.keys()
+        return [dict(zip(keys, row)) for row in result]
+
+    def get(self, *pargs, **kwargs):
         """
             query based on primary_keys
 
             :param pargs: ident
+            :param fields: only load these columns
         """
 
         result = []
         try:
-            instance = self.session.query(self.model)
-
-            if isinstance(pargs, tuple):
-                for args in pargs:
-                    result.append(self.to_dict(instance.get(args).__dict__))
-            else:
-                result.append(self.to_dict(instance.get(pargs).__dict__))
+            result = self.get_by_ids(pargs, kwargs.get('fields'))[0]
         except:
             self.logging_error()
         return result
 
+    def _coerce_ids(self, column, ids):
+        """
+            Convert the ids of a request to the type of the primary key column
+
+            :return: ([(typed value, id)] without duplicates, the ids that can not be converted)
+        """
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = None
+        if python_type is not None and issubclass(python_type, basestring):
+            python_type = None
+
+        requested = []
+        invalid   = []
+        seen      = set()
+        for ident in ids:
+            try:
+                value = ident if python_type is None or isinstance(ident, python_type) else python_type(ident)
+            except (TypeError, ValueError):
+                invalid.append(ident)
+                continue
+            if value not in seen:
+                seen.add(value)
+                requested.append((value, ident))
+        return requested, invalid
+
+    def get_by_ids(self, ids, fields=None):
+        """
+            Fetch the rows of several primary keys with a single IN query
+
+            :param ids: primary key values, as strings from the URL or typed
+            :param fields: only load these columns
+            :return: (rows in the order of ids, the ids that were not found)
+        """
+        return self._cached('get_by_ids', [list(ids), fields], lambda: self._get_by_ids(ids, fields))
+
+    def _get_by_ids(self, ids, fields):
+        pkey   = self.primary_key()
+        column = getattr(self.model, pkey)
+        requested, missing = self._coerce_ids(column, ids)
+        if len(requested) == 0:
+            return [], missing
+
+        # the primary key is needed to put the rows back in order
+        extra = fields is not None and pkey not in fields
+        rows  = self._fetch(self._query(fields + [pkey] if extra else fields)
+                            .filter(column.in_([value for value, _ in requested])))
+        found = dict((row[pkey], row) for row in rows)
+
+        result = []
+        for value, ident in requested:
+            row = found.get(value)
+            if row is None:
+                missing.append(ident)
+                continue
+            if extra:
+                row.pop(pkey)
+            result.append(row)
+        return result, missing
+
     def all(self, **kwargs):
+        """
+            Rows matching kwargs, as dicts (or tuples with as_tuples=True).
+        """
         buffer   = []
         try:
-            instance = self.session.query(self.model)
-            for row in self._apply_kwargs(instance, **kwargs).all():
-                buffer.append(self.to_dict(row.__dict__))
+            arguments= dict(kwargs)
+            as_tuples= kwargs.pop('as_tuples', False)
+            instance = self._query(kwargs.pop('fields', None))
+            buffer   = self._cached('all', arguments,
+                                    lambda: self._fetch(self._apply_kwargs(instance, **kwargs), as_tuples))
+        except IllegalArgumentError:
+            raise
         except:
             self.logging_error()
         return buffer
 
+    def iter_chunks(self, chunk_size=500, **kwargs):
+        """
+            Rows matching kwargs, yielded in lists of at most chunk_size dicts.
+
+            The SELECT runs on a server-side cursor where the driver supports
+            it, so only one chunk is held in memory at a time.
+        """
+        statement  = self._apply_kwargs(self._query(kwargs.pop('fields', None)), **kwargs).statement
+        connection = self.session.connection(clause=statement).execution_options(stream_results=True)
+        result     = connection.execute(statement)
+        keys       = result.keys()
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [dict(zip(keys, row)) for row in rows]
+        finally:
+            result.close()
+
     def one(self, **kwargs):
         try:
-            instance = self.session.query(self.model)
-            result   = self._apply_kwargs(instance, **kwargs).one()
-            return [self.to_dict(result.__dict__)]
+            instance = self._query(kwargs.pop('fields', None))
+            # two rows are enough to tell that the result is not unique, a smaller limit is kept
+            limit    = kwargs.get('limit')
+            kwargs['limit'] = 2 if limit is None else min(int(limit), 2)
+            result   = self._fetch(self._apply_kwargs(instance, **kwargs))
+            return result if len(result)==1 else []
+        except IllegalArgumentError:
+            raise
         except:
             return []
 
@@ -320,10 +548,12 @@ class AlchemyWrapper(object):
         instance = self.session.query(self.model)
         try:
             number = self._apply_kwargs(instance, **kwargs).delete()
-            self.session.commit()
+            self.commit()
+        except IllegalArgumentError:
+            raise
         except:
             self.logging_error()
-            self.session.rollback()
+            self.rollback()
             number = 0
         return number
 
@@ -332,10 +562,50 @@ class AlchemyWrapper(object):
         number   = 0
         try:
             number = self._apply_kwargs(instance, **kwargs).update(values)
-            self.session.commit()
+            self.commit()
+        except IllegalArgumentError:
+            raise
         except:
             self.logging_error()
-            self.session.rollback()
+            self.rollback()
+        return number
+
+    def delete_by_ids(self, ids, chunk_size=None):
+        """
+            Delete the rows of several primary keys in one transaction,
+            with one DELETE ... WHERE pk IN (...) per chunk of ids
+
+            :return: the number of deleted rows
+            :raise: the error of the failing statement, nothing is deleted then
+        """
+        return self._write_by_ids(lambda query: query.delete(synchronize_session=False), ids, chunk_size)
+
+    def update_by_ids(self, values, ids, chunk_size=None):
+        """
+            Update the rows of several primary keys in one transaction,
+            with one UPDATE ... WHERE pk IN (...) per chunk of ids
+
+            :return: the number of updated rows
+            :raise: the error of the failing statement, nothing is updated then
+        """
+        return self._write_by_ids(lambda query: query.update(values, synchronize_session=False), ids, chunk_size)
+
+    def _write_by_ids(self, statement, ids, chunk_size):
+        chunk_size = chunk_size or options.pk_chunk_size
+        column     = getattr(self.model, self.primary_key())
+        # ids that do not fit the column type can not match any row
+        values     = [value for value, _ in self._coerce_ids(column, ids)[0]]
+
+        number = 0
+        try:
+            for start in range(0, len(values), chunk_size):
+                query   = self.session.query(self.model).filter(column.in_(values[start:start + chunk_size]))
+                number += statement(query)
+            self.commit()
+        except:
+            self.logging_error()
+            self.rollback()
+            raise
         return number
 
     def get_fk_info(self, values, table=''):
@@ -419,6 +689,13 @@ class AlchemyWrapper(object):
         return result
 
     def multiple_table_query(self, keyword, kwargs):
+        tables = [self.tablename, keyword]
+        if keyword == 'program':
+            tables.extend(['program_genre_map', 'program_movierate_map', 'movierate', 'people', 'program_people_role_map'])
+        return self._cached('multiple_table_query', [keyword, dict(kwargs)],
+                            lambda: self._multiple_table_query(keyword, kwargs), tables)
+
+    def _multiple_table_query(self, keyword, kwargs):
         buff_A = []
         buff_B = []
         result = {}
@@ -433,10 +710,14 @@ class AlchemyWrapper(object):
             criterion = self.base.getPrimaryKeys(keyword).get('constrained_columns', [])[0]
             direction = 'desc'
 
+        keyset  = 'after' in kwargs
+        after   = kwargs.pop('after', None)
+        count_mode = kwargs.pop('count_mode', 'exact')
         distinct= kwargs.pop('distinct')if 'distinct'in kwargs else None
         offset  = kwargs.pop('offset')  if 'offset'  in kwargs else None
         limit   = kwargs.pop('limit')   if 'limit'   in kwargs else None
         filters = kwargs.pop('filters') if 'filters' in kwargs else None
+        signature = (self.tablename, keyword, kwargs, distinct, filters, criterion, direction)
 
         for fk in fkeys:
             if keyword == fk['referred_table']:
@@ -461,13 +742,15 @@ class AlchemyWrapper(object):
                     criterion = 'sequence'
                 else:
                     order_ins = temporary
-                if direction == 'asc':
-                    expression = asc(getattr(order_ins, criterion))
-                else:
-                    expression = desc(getattr(order_ins, criterion))
+                keys    = self.keyset_columns(criterion, order_ins.__table__.name) if keyset else [criterion]
+                columns = [getattr(order_ins, key) for key in keys]
+                order   = asc if direction == 'asc' else desc
 
-                instance = instance.order_by(expression)
-                count    = instance.count()
+                instance = instance.order_by(*[order(column) for column in columns])
+                count, count_mode = self._total(instance, count_mode, signature)
+
+                if after is not None:
+                    instance = instance.filter(keyset_filter(columns, after, direction))
 
                 if offset is not None:
                     instance = instance.offset(offset)
@@ -519,5 +802,28 @@ class AlchemyWrapper(object):
                         buff_A.append(info_A)
                         buff_B.append(info_B)
                     result = {self.tablename:buff_A, keyword:buff_B, 'count':count}
+
+                result['count_mode'] = count_mode
+                if keyset:
+                    # the cursor is the sort key of the last row of the page
+                    rows = buff_B if order_ins is temporary else buff_A
+                    result['next_cursor'] = None
+                    if limit is not None and len(rows) > 0 and len(rows) >= int(limit):
+                        result['next_cursor'] = encode_cursor([rows[-1].get(key) for key in keys])
                 break
         return result
+
+_counts = None
+
+def count_cache():
+    """
+        The cache of count=cached, built on first use so that it is sized
+        by the parsed --count_cache_size.
+    """
+    global _counts
+    if _counts is None:
+        _counts = LRUCache(options.count_cache_size)
+    return _counts
+
+# the writes committed through the wrappers, the unit of work, the audit writer...
+on_write(querycache.invalidate)